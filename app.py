@@ -4,30 +4,30 @@
 CDK Application for running ConsoleMe on ECS
 """
 
-import os
-import boto3
-import yaml
-
 from aws_cdk import core as cdk
 from cdk.consoleme_ecs_service.consoleme_ecs_service_stack import ConsolemeEcsServiceStack
 from cdk.consoleme_ecs_service.constants import BASE_NAME, SPOKE_BASE_NAME
 from cdk.consoleme_ecs_service.consoleme_spoke_accounts_stack import ConsolemeSpokeAccountsStack
+from configuration import load_config, resolve_account_id, resolve_region
 
-config_yaml = yaml.load(
-    open('config.yaml'), Loader=yaml.FullLoader)
+config_yaml = load_config()
 
 spoke_accounts = config_yaml['spoke_accounts']
 
-main_environment = cdk.Environment(account=boto3.client(
-    'sts').get_caller_identity().get('Account'), region=os.getenv('AWS_REGION'))
-
 app = cdk.App()
 
-for spoke_account_id in spoke_accounts:
-    spoke_environment = cdk.Environment(
-        account=spoke_account_id, region=os.getenv('AWS_REGION'))
-    spoke_stack = ConsolemeSpokeAccountsStack(
-        app, SPOKE_BASE_NAME, env=spoke_environment)  # Spoke account stack
+main_account_id = resolve_account_id(app)
+region = resolve_region(app)
+
+main_environment = cdk.Environment(account=main_account_id, region=region)
+
+if config_yaml['spoke_accounts_deployment']['mode'] == 'stacks':
+    for spoke_account_id in spoke_accounts:
+        spoke_environment = cdk.Environment(
+            account=spoke_account_id, region=region)
+        spoke_stack = ConsolemeSpokeAccountsStack(
+            app, SPOKE_BASE_NAME + spoke_account_id, main_account_id=main_account_id,
+            env=spoke_environment)  # Spoke account stack, named after its account
 
 consoleme_ecs_service_stack = ConsolemeEcsServiceStack(
     app, BASE_NAME, env=main_environment)  # Consoleme account
@@ -0,0 +1,349 @@
+"""
+Loading and validating the configuration file, and resolving the deployment environment
+"""
+
+import functools
+import os
+import urllib.request
+
+import boto3
+import yaml
+
+from aws_cdk import core as cdk
+
+CONFIG_FILE_ENV = 'CONSOLEME_CONFIG_FILE'
+OFFLINE_ENV = 'CONSOLEME_OFFLINE_SYNTH'
+
+OFFLINE_ACCOUNT_ID = '000000000000'
+OFFLINE_INGRESS_CIDR = '127.0.0.1/32'
+
+# Task CPU units, and the memory in MiB each of them supports
+FARGATE_TASK_SIZES = {
+    256: range(512, 2048 + 1, 512),
+    512: range(1024, 4096 + 1, 1024),
+    1024: range(2048, 8192 + 1, 1024),
+    2048: range(4096, 16384 + 1, 1024),
+    4096: range(8192, 30720 + 1, 1024)
+}
+
+CELERY_DEFAULT_QUEUE = 'celery'
+
+# Each web process is a load balancer target of its service, and ECS allows 5 of them per service
+MAX_WEB_PROCESSES = 5
+
+# Each spoke stack is deployed one account at a time, so larger account fleets use the StackSet instead
+MAX_SPOKE_ACCOUNT_STACKS = 20
+
+# Global secondary indexes of the ConsoleMe tables
+DYNAMODB_TABLE_INDEXES = {
+    'consoleme_policy_requests': ['arn-request_id-index'],
+    'consoleme_resource_cache': ['arn-index']
+}
+
+REQUIRED_KEYS = {
+    'domain_prefix': str,
+    'spoke_accounts': list,
+    'spoke_accounts_deployment': dict,
+    'spoke_accounts_discovery': dict,
+    'hosted_zone_id': str,
+    'hosted_zone_name': str,
+    'container_image': str,
+    'container_registry': dict,
+    'min_capacity': int,
+    'max_capacity': int,
+    'web_processes': int,
+    'web_autoscaling': dict,
+    'load_balancing': dict,
+    'path_routing': dict,
+    'capacity_providers': dict,
+    'celery_worker': dict,
+    'task_sizes': dict,
+    'redis': dict,
+    'celery_broker_redis': dict,
+    'dynamodb_target_utilization': int,
+    'dynamodb_tables': dict,
+    'dax': dict,
+    'admin_temp_password': str,
+    'jwt_secret': str
+}
+
+
+def is_offline() -> bool:
+    """
+    Returns whether synth must run without any network access, such as in tests and sandboxed CI jobs
+    """
+    return os.getenv(OFFLINE_ENV, '').lower() in ('1', 'true', 'yes')
+
+
+def _validate_task_size(name: str, task_size: dict) -> None:
+    if not task_size:
+        raise ValueError(f'{name} is required')
+    if task_size['memory_limit_mib'] not in FARGATE_TASK_SIZES.get(task_size['cpu'], []):
+        raise ValueError(f'{name} cpu and memory_limit_mib must be a valid Fargate task size')
+    if task_size['container_cpu'] > task_size['cpu'] \
+            or task_size['container_memory_reservation_mib'] > task_size['memory_limit_mib']:
+        raise ValueError(f'{name} container reservations must fit in the task size')
+
+
+def _validate_capacity(name: str, capacity_config: dict) -> None:
+    for capacity_key in ('read_capacity', 'write_capacity'):
+        capacity = capacity_config.get(capacity_key)
+        if not isinstance(capacity, dict) \
+                or not isinstance(capacity.get('min'), int) or not isinstance(capacity.get('max'), int):
+            raise ValueError(f'{name} {capacity_key} min and max are required for the provisioned billing mode')
+        if not 1 <= capacity['min'] <= capacity['max']:
+            raise ValueError(f'{name} {capacity_key} min must be at least 1 and not more than max')
+
+
+def validate_config(config_yaml: dict) -> None:
+    """
+    Raises ValueError when the configuration is missing keys or has values of the wrong type
+    """
+    if not isinstance(config_yaml, dict):
+        raise ValueError('Configuration file must be a YAML mapping')
+
+    missing_keys = [key for key in REQUIRED_KEYS if key not in config_yaml]
+    if missing_keys:
+        raise ValueError('Configuration file is missing keys: ' + ', '.join(missing_keys))
+
+    for key, value_type in REQUIRED_KEYS.items():
+        if not isinstance(config_yaml[key], value_type):
+            raise ValueError(f'Configuration key {key} must be of type {value_type.__name__}')
+
+    for account_id in config_yaml['spoke_accounts']:
+        if not isinstance(account_id, str) or len(account_id) != 12 or not account_id.isdigit():
+            raise ValueError(f'Spoke account {account_id} must be a quoted 12 digit account id')
+
+    if config_yaml['spoke_accounts_deployment'].get('mode') not in ('stacks', 'stackset'):
+        raise ValueError('spoke_accounts_deployment mode must be stacks or stackset')
+
+    if config_yaml['spoke_accounts_deployment']['mode'] == 'stacks' \
+            and len(config_yaml['spoke_accounts']) > MAX_SPOKE_ACCOUNT_STACKS:
+        raise ValueError(f'spoke_accounts_deployment mode must be stackset for more than {MAX_SPOKE_ACCOUNT_STACKS} '
+                         f'spoke accounts')
+
+    if config_yaml['spoke_accounts_deployment'].get('call_as', 'SELF') not in ('SELF', 'DELEGATED_ADMIN'):
+        raise ValueError('spoke_accounts_deployment call_as must be SELF or DELEGATED_ADMIN')
+
+    if config_yaml['spoke_accounts_deployment'].get('call_as') == 'DELEGATED_ADMIN' \
+            and not config_yaml['spoke_accounts_deployment'].get('organizational_unit_ids'):
+        raise ValueError('spoke_accounts_deployment call_as DELEGATED_ADMIN requires organizational_unit_ids')
+
+    if config_yaml['spoke_accounts_discovery'].get('source') not in ('config', 'organizations', 's3'):
+        raise ValueError('spoke_accounts_discovery source must be config, organizations or s3')
+
+    if config_yaml['spoke_accounts_discovery']['source'] == 's3' \
+            and not config_yaml['spoke_accounts_discovery'].get('manifest_key'):
+        raise ValueError('spoke_accounts_discovery manifest_key is required for the s3 source')
+
+    if config_yaml['spoke_accounts_discovery']['source'] != 'config' \
+            and not config_yaml['spoke_accounts_discovery'].get('refresh_schedule'):
+        raise ValueError('spoke_accounts_discovery refresh_schedule is required for the organizations and s3 sources')
+
+    container_registry_config = config_yaml['container_registry']
+
+    if container_registry_config.get('mode') not in ('docker_hub', 'pull_through_cache', 'repository'):
+        raise ValueError('container_registry mode must be docker_hub, pull_through_cache or repository')
+
+    if container_registry_config['mode'] == 'pull_through_cache' \
+            and not container_registry_config.get('credential_arn'):
+        raise ValueError('container_registry credential_arn is required for the pull_through_cache mode')
+
+    image_digest = container_registry_config.get('image_digest')
+    if image_digest and not image_digest.startswith('sha256:'):
+        raise ValueError('container_registry image_digest must be a sha256 digest')
+
+    if config_yaml['min_capacity'] > config_yaml['max_capacity']:
+        raise ValueError('min_capacity must not be greater than max_capacity')
+
+    if not 1 <= config_yaml['web_processes'] <= MAX_WEB_PROCESSES:
+        raise ValueError(f'web_processes must be between 1 and {MAX_WEB_PROCESSES}')
+
+    for scheduled_scaling in config_yaml['web_autoscaling'].get('scheduled', []):
+        if scheduled_scaling['min_capacity'] > scheduled_scaling['max_capacity']:
+            raise ValueError(f"web_autoscaling scheduled {scheduled_scaling['name']} min_capacity must not be greater than max_capacity")
+
+    for service in ('web', 'celery_worker'):
+        strategies = config_yaml['capacity_providers'].get(service)
+        if not strategies:
+            raise ValueError(f'capacity_providers {service} must list at least one capacity provider')
+        if any(strategy.get('capacity_provider') not in ('FARGATE', 'FARGATE_SPOT') for strategy in strategies):
+            raise ValueError(f'capacity_providers {service} capacity_provider must be FARGATE or FARGATE_SPOT')
+        if len([strategy for strategy in strategies if strategy.get('base')]) > 1:
+            raise ValueError(f'capacity_providers {service} may only set a base on one capacity provider')
+
+    if not config_yaml['celery_worker'].get('pools'):
+        raise ValueError('celery_worker pools must define at least one worker pool')
+
+    pool_queues = {}
+
+    for pool_name, worker_config in celery_worker_pools(config_yaml).items():
+        if not pool_name.replace('_', '').isalnum():
+            raise ValueError(f'celery_worker pool name {pool_name} must only have letters, digits and underscores')
+
+        if not worker_config.get('queues'):
+            raise ValueError(f'celery_worker pool {pool_name} must consume at least one queue')
+
+        for queue_name in worker_config['queues']:
+            if queue_name in pool_queues:
+                raise ValueError(
+                    f'celery_worker queue {queue_name} is consumed by both {pool_queues[queue_name]} and {pool_name}')
+            pool_queues[queue_name] = pool_name
+
+        if worker_config['min_capacity'] > worker_config['max_capacity']:
+            raise ValueError(f'celery_worker pool {pool_name} min_capacity must not be greater than max_capacity')
+
+        if worker_config.get('pool') not in ('prefork', 'gevent', 'threads'):
+            raise ValueError(f'celery_worker pool {pool_name} pool must be prefork, gevent or threads')
+
+        if worker_config.get('log_level') not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+            raise ValueError(
+                f'celery_worker pool {pool_name} log_level must be DEBUG, INFO, WARNING, ERROR or CRITICAL')
+
+        if worker_config.get('autoscale'):
+            if worker_config['pool'] != 'prefork':
+                raise ValueError(f'celery_worker pool {pool_name} autoscale requires the prefork pool')
+            if worker_config['autoscale']['min'] > worker_config['autoscale']['max']:
+                raise ValueError(f'celery_worker pool {pool_name} autoscale min must not be greater than max')
+        elif not worker_config.get('concurrency'):
+            raise ValueError(f'celery_worker pool {pool_name} concurrency or autoscale is required')
+
+    # Tasks without a route are sent to the Celery default queue, which must have workers
+    if CELERY_DEFAULT_QUEUE not in pool_queues:
+        raise ValueError(f'celery_worker pools must consume the {CELERY_DEFAULT_QUEUE} queue')
+
+    for task_name in ('web', 'celery_worker', 'celery_beat'):
+        _validate_task_size('task_sizes ' + task_name, config_yaml['task_sizes'].get(task_name))
+
+    load_balancing_config = config_yaml['load_balancing']
+    health_check_config = load_balancing_config.get('health_check', {})
+
+    if not health_check_config.get('path', '').startswith('/'):
+        raise ValueError('load_balancing health_check path must start with /')
+
+    if health_check_config['timeout_seconds'] >= health_check_config['interval_seconds']:
+        raise ValueError('load_balancing health_check timeout_seconds must be less than interval_seconds')
+
+    if not 0 <= load_balancing_config['deregistration_delay_seconds'] <= 3600:
+        raise ValueError('load_balancing deregistration_delay_seconds must be between 0 and 3600')
+
+    if load_balancing_config.get('slow_start_seconds'):
+        if not 30 <= load_balancing_config['slow_start_seconds'] <= 900:
+            raise ValueError('load_balancing slow_start_seconds must be 0, or between 30 and 900')
+        if load_balancing_config.get('least_outstanding_requests'):
+            raise ValueError('load_balancing slow_start_seconds is not supported with least_outstanding_requests')
+
+    for group_name, path_group_config in config_yaml['path_routing'].items():
+        if not group_name.replace('_', '').isalnum():
+            raise ValueError(f'path_routing group name {group_name} must only have letters, digits and underscores')
+        # Listener rules allow up to five condition values
+        if not 0 < len(path_group_config.get('paths', [])) <= 5:
+            raise ValueError(f'path_routing {group_name} paths must list one to five path patterns')
+        if path_group_config['min_capacity'] > path_group_config['max_capacity']:
+            raise ValueError(f'path_routing {group_name} min_capacity must not be greater than max_capacity')
+        if not 1 <= path_group_config.get('web_processes', 0) <= MAX_WEB_PROCESSES:
+            raise ValueError(f'path_routing {group_name} web_processes must be between 1 and {MAX_WEB_PROCESSES}')
+        _validate_task_size(f'path_routing {group_name} task_size', path_group_config.get('task_size'))
+
+    # ConsoleMe connects with a plain Redis client to database 0, which a cluster mode enabled Redis would answer with
+    # MOVED redirections for the keys on other shards
+    for redis_key in ('redis', 'celery_broker_redis'):
+        if config_yaml[redis_key].get('cluster_mode'):
+            raise ValueError(f'{redis_key} cluster_mode is not supported, scale with a larger node_type')
+        if config_yaml[redis_key].get('automatic_failover') and not config_yaml[redis_key].get('replicas_per_shard'):
+            raise ValueError(f'{redis_key} automatic_failover requires replicas_per_shard of at least 1')
+
+    for table_name, table_config in config_yaml['dynamodb_tables'].items():
+        if table_config.get('billing_mode') not in ('on_demand', 'provisioned'):
+            raise ValueError(f'Table {table_name} billing_mode must be on_demand or provisioned')
+
+        if table_config['billing_mode'] == 'provisioned':
+            _validate_capacity(f'Table {table_name}', table_config)
+            missing_indexes = [index_name for index_name in DYNAMODB_TABLE_INDEXES.get(table_name, [])
+                               if index_name not in table_config.get('indexes', {})]
+            if missing_indexes:
+                raise ValueError(f'Table {table_name} indexes {", ".join(missing_indexes)} require capacity '
+                                 f'for the provisioned billing mode')
+
+        for index_name, index_config in table_config.get('indexes', {}).items():
+            if index_name not in DYNAMODB_TABLE_INDEXES.get(table_name, []):
+                raise ValueError(f'Table {table_name} has no index {index_name}')
+            if table_config['billing_mode'] == 'provisioned':
+                _validate_capacity(f'Index {index_name}', index_config)
+
+            projection_config = index_config.get('projection', {'type': 'all'})
+            if projection_config.get('type') not in ('all', 'keys_only', 'include'):
+                raise ValueError(f'Index {index_name} projection type must be all, keys_only or include')
+            if projection_config['type'] == 'include' and not projection_config.get('non_key_attributes'):
+                raise ValueError(f'Index {index_name} include projection requires non_key_attributes')
+            # ConsoleMe only queries its own index names, and renaming an index replaces it in a single update,
+            # which DynamoDB rejects, so the projection is only chosen when the table is created
+            if 'index_name' in projection_config:
+                raise ValueError(f'Index {index_name} projection can\'t rename the index ConsoleMe queries')
+
+
+def celery_worker_pools(config_yaml: dict) -> dict:
+    """
+    Returns the configuration of each Celery worker pool, with the shared celery_worker settings it does not override
+    """
+    shared_config = {key: value for key, value in config_yaml['celery_worker'].items() if key != 'pools'}
+
+    return {pool_name: dict(shared_config, **(pool_config or {}))
+            for pool_name, pool_config in config_yaml['celery_worker']['pools'].items()}
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(config_file: str = None) -> dict:
+    """
+    Returns the validated configuration file, parsed once per process
+    """
+    config_file = config_file or os.getenv(CONFIG_FILE_ENV, 'config.yaml')
+
+    with open(config_file) as config:
+        config_yaml = yaml.load(config, Loader=yaml.FullLoader)
+
+    validate_config(config_yaml)
+
+    return config_yaml
+
+
+@functools.lru_cache(maxsize=None)
+def _caller_account_id() -> str:
+    return boto3.client('sts').get_caller_identity().get('Account')
+
+
+@functools.lru_cache(maxsize=None)
+def _caller_public_ip() -> str:
+    return urllib.request.urlopen('http://checkip.amazonaws.com').read().decode('utf-8').strip()
+
+
+def resolve_account_id(scope: cdk.Construct) -> str:
+    """
+    Returns the main account id from the main_account_id context, the CDK CLI environment or STS
+    """
+    account_id = scope.node.try_get_context('main_account_id') or os.getenv('CDK_DEFAULT_ACCOUNT')
+
+    if account_id:
+        return account_id
+
+    return OFFLINE_ACCOUNT_ID if is_offline() else _caller_account_id()
+
+
+def resolve_region(scope: cdk.Construct) -> str:
+    """
+    Returns the deployment region from the region context or the environment
+    """
+    return scope.node.try_get_context('region') or os.getenv('AWS_REGION') or os.getenv('CDK_DEFAULT_REGION')
+
+
+def resolve_ingress_cidr(scope: cdk.Construct) -> str:
+    """
+    Returns the CIDR allowed to reach the load balancer from the ingress_cidr context,
+    the CONSOLEME_INGRESS_CIDR environment variable or the deploying computer public ip
+    """
+    ingress_cidr = scope.node.try_get_context('ingress_cidr') or os.getenv('CONSOLEME_INGRESS_CIDR')
+
+    if ingress_cidr:
+        return ingress_cidr
+
+    return OFFLINE_INGRESS_CIDR if is_offline() else _caller_public_ip() + '/32'
@@ -17,7 +17,9 @@ from nested_stacks.db_stack import DBStack
 from nested_stacks.auth_stack import AuthStack
 from nested_stacks.config_stack import ConfigStack
 
-from constants import BASE_NAME
+from consoleme_spoke_accounts_stack import ConsolemeSpokeAccountsStack
+from configuration import load_config
+from constants import BASE_NAME, SPOKE_BASE_NAME
 
 
 class ConsolemeEcsServiceStack(cdk.Stack):
@@ -42,14 +44,17 @@ class ConsolemeEcsServiceStack(cdk.Stack):
             s3_bucket=shared_stack.s3_bucket
         )
 
-        DBStack(
+        vpc_stack = VPCStack(
             self,
-            'DB'
+            'VPC'
         )
 
-        vpc_stack = VPCStack(
+        db_stack = DBStack(
             self,
-            'VPC'
+            'DB',
+            vpc=vpc_stack.vpc,
+            dax_sg=vpc_stack.dax_sg,
+            dax_service_role=iam_stack.dax_service_role
         )
 
         alb_stack = ALBStack(
@@ -75,14 +80,18 @@ class ConsolemeEcsServiceStack(cdk.Stack):
             self,
             'Cache',
             vpc=vpc_stack.vpc,
-            redis_sg=vpc_stack.redis_sg
+            redis_sg=vpc_stack.redis_sg,
+            broker_metrics_sg=vpc_stack.broker_metrics_sg,
+            broker_metrics_lambda_role_arn=iam_stack.broker_metrics_lambda_role.role_arn
         )
 
         config_stack = ConfigStack(
             self,
             'Config',
             cognito_user_pool=auth_stack.cognito_user_pool,
-            redis=cache_stack.redis,
+            redis_host=cache_stack.redis_host,
+            celery_broker_host=cache_stack.celery_broker_host,
+            dax_endpoint=db_stack.dax_endpoint,
             domain_name=domain_stack.route53_record.domain_name,
             s3_bucket_name=shared_stack.s3_bucket.bucket_name,
             create_configuration_lambda_role_arn=iam_stack.create_configuration_lambda_role.role_arn
@@ -97,11 +106,50 @@ class ConsolemeEcsServiceStack(cdk.Stack):
             s3_bucket_name=shared_stack.s3_bucket.bucket_name,
             certificate=domain_stack.certificate,
             task_role_arn=iam_stack.ecs_task_role.role_arn,
-            task_execution_role_arn=iam_stack.ecs_task_execution_role.role_arn
+            task_execution_role_arn=iam_stack.ecs_task_execution_role.role_arn,
+            config_restart_token=config_stack.config_restart_token,
+            container_image_uri=shared_stack.container_image_uri
         )
 
         compute_stack.node.add_dependency(config_stack)
 
+        # Spoke accounts trust role, rolled out by a StackSet for large account fleets
+
+        spoke_deployment_config = load_config()['spoke_accounts_deployment']
+
+        if spoke_deployment_config['mode'] == 'stackset':
+            organizational_unit_ids = spoke_deployment_config.get('organizational_unit_ids')
+
+            if organizational_unit_ids:
+                deployment_targets = cdk.CfnStackSet.DeploymentTargetsProperty(
+                    organizational_unit_ids=organizational_unit_ids)
+            else:
+                deployment_targets = cdk.CfnStackSet.DeploymentTargetsProperty(
+                    accounts=load_config()['spoke_accounts'])
+
+            cdk.CfnStackSet(
+                self,
+                f'{SPOKE_BASE_NAME}StackSet',
+                stack_set_name=SPOKE_BASE_NAME,
+                permission_model='SERVICE_MANAGED' if organizational_unit_ids else 'SELF_MANAGED',
+                call_as=spoke_deployment_config.get('call_as', 'SELF'),
+                auto_deployment=cdk.CfnStackSet.AutoDeploymentProperty(
+                    enabled=True, retain_stacks_on_account_removal=False) if organizational_unit_ids else None,
+                capabilities=['CAPABILITY_NAMED_IAM'],
+                template_body=ConsolemeSpokeAccountsStack.template_body(self.account),
+                operation_preferences=cdk.CfnStackSet.OperationPreferencesProperty(
+                    max_concurrent_percentage=spoke_deployment_config['max_concurrent_percentage'],
+                    failure_tolerance_percentage=spoke_deployment_config['failure_tolerance_percentage'],
+                    region_concurrency_type='PARALLEL'
+                ),
+                stack_instances_group=[
+                    cdk.CfnStackSet.StackInstancesProperty(
+                        deployment_targets=deployment_targets,
+                        regions=[self.region]
+                    )
+                ]
+            )
+
         # Output the service URL to CloudFormation outputs
 
         cdk.CfnOutput(
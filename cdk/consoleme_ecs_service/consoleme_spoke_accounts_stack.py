@@ -2,7 +2,8 @@
 Spoke accounts stack for running ConsoleMe on ECS
 """
 
-import boto3
+import json
+import tempfile
 
 from aws_cdk import (
     aws_iam as iam,
@@ -18,12 +19,10 @@ class ConsolemeSpokeAccountsStack(cdk.Stack):
     Granting the neccesary permissions for ConsoleMe main account role
     """
 
-    def __init__(self, scope: cdk.Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: cdk.Construct, id: str, main_account_id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
-        trusted_role_arn = 'arn:aws:iam::' + \
-                           boto3.client('sts').get_caller_identity().get(
-                               'Account') + ':role/ConsolemeTaskRole'
+        trusted_role_arn = 'arn:aws:iam::' + main_account_id + ':role/ConsolemeTaskRole'
 
         spoke_role = iam.Role(
             self,
@@ -70,3 +69,20 @@ class ConsolemeSpokeAccountsStack(cdk.Stack):
                 resources=['*']
             )
         )
+
+    @classmethod
+    def template_body(cls, main_account_id: str) -> str:
+        """
+        Returns the spoke account template as a standalone JSON document for a StackSet,
+        synthesized without the CDK bootstrap version check so it deploys into accounts without bootstrapping
+        """
+
+        if cdk.Token.is_unresolved(main_account_id):
+            raise ValueError('The main account id must be known at synth time to deploy the spoke accounts StackSet')
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            spoke_app = cdk.App(outdir=out_dir)
+            cls(spoke_app, SPOKE_BASE_NAME, main_account_id=main_account_id,
+                synthesizer=cdk.LegacyStackSynthesizer())
+
+            return json.dumps(spoke_app.synth().get_stack_by_name(SPOKE_BASE_NAME).template)
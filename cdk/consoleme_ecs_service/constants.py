@@ -2,10 +2,9 @@
 Defining constants and resolving variables through configuration file
 """
 
-import yaml
+from configuration import load_config
 
-config_yaml = yaml.load(
-    open('config.yaml'), Loader=yaml.FullLoader)
+config_yaml = load_config()
 
 domain_prefix = config_yaml['domain_prefix']
 
@@ -18,3 +17,18 @@ HOSTED_ZONE_ID = config_yaml['hosted_zone_id']
 HOSTED_ZONE_NAME = config_yaml['hosted_zone_name']
 ADMIN_TEMP_PASSWORD = config_yaml['admin_temp_password']
 CONTAINER_IMAGE = config_yaml['container_image']
+DOCKER_HUB_REGISTRY_URL = 'registry-1.docker.io'
+
+DAX_CLUSTER_NAME = 'consoleme-dax'
+DAX_PORT = 9111
+DAX_CACHED_TABLES = ['consoleme_iamroles_global', 'consoleme_resource_cache']
+
+CONSOLEME_PORT = 8081
+
+CONFIG_VOLUME_NAME = 'consoleme-config'
+CONFIG_MOUNT_PATH = '/consoleme_config'
+
+CELERY_APP = 'consoleme.celery_tasks.celery_tasks'
+CELERY_METRICS_NAMESPACE = 'ConsoleMe/Celery'
+CELERY_BACKLOG_METRIC_NAME = 'BrokerBacklog'
+CELERY_QUEUE_LENGTH_METRIC_NAME = 'QueueLength'
@@ -5,9 +5,17 @@ Cache stack for running ConsoleMe on ECS
 from aws_cdk import (
     aws_ec2 as ec2,
     aws_elasticache as ec,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_logs as logs,
     core as cdk
 )
 
+from configuration import load_config, celery_worker_pools
+from constants import CELERY_METRICS_NAMESPACE, CELERY_BACKLOG_METRIC_NAME
+
 
 class CacheStack(cdk.NestedStack):
     """
@@ -15,10 +23,13 @@ class CacheStack(cdk.NestedStack):
     """
 
     def __init__(self, scope: cdk.Construct, id: str,
-                 vpc: ec2.Vpc, redis_sg: ec2.SecurityGroup, **kwargs) -> None:
+                 vpc: ec2.Vpc, redis_sg: ec2.SecurityGroup, broker_metrics_sg: ec2.SecurityGroup,
+                 broker_metrics_lambda_role_arn: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
-        # Redis node
+        config_yaml = load_config()
+
+        # Redis clusters for the ConsoleMe cache and the Celery broker
 
         subnet_ids = []
         for subnet in vpc.private_subnets:
@@ -32,16 +43,117 @@ class CacheStack(cdk.NestedStack):
             subnet_ids=subnet_ids
         )
 
-        redis = ec.CfnCacheCluster(
+        # The application cache evicts cold keys, while the Celery broker must never drop queued tasks
+
+        redis, redis_host, redis_port, _ = self._redis_cluster(
+            'Redis',
+            description='ConsoleMe cache Redis',
+            redis_config=config_yaml['redis'],
+            cache_subnet_group_name=redis_subnet_group.ref,
+            security_group_id=redis_sg.security_group_id
+        )
+
+        celery_broker_redis, celery_broker_host, celery_broker_port, celery_broker_reader_host = self._redis_cluster(
+            'BrokerRedis',
+            description='ConsoleMe Celery broker Redis',
+            redis_config=config_yaml['celery_broker_redis'],
+            cache_subnet_group_name=redis_subnet_group.ref,
+            security_group_id=redis_sg.security_group_id
+        )
+
+        # Celery broker queue length metrics, published every minute from inside the VPC
+
+        imported_broker_metrics_lambda_role = iam.Role.from_role_arn(
+            self,
+            'ImportedBrokerMetricsLambdaRole',
+            role_arn=broker_metrics_lambda_role_arn
+        )
+
+        broker_metrics_lambda = lambda_.Function(
+            self,
+            'BrokerMetricsLambda',
+            code=lambda_.Code.from_asset('resources/broker_metrics_lambda', exclude=['__pycache__']),
+            handler='index.handler',
+            timeout=cdk.Duration.seconds(30),
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            role=imported_broker_metrics_lambda_role,
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE),
+            security_groups=[broker_metrics_sg],
+            log_retention=logs.RetentionDays.ONE_WEEK,
+            environment={
+                'REDIS_HOST': celery_broker_reader_host,
+                'REDIS_PORT': celery_broker_port,
+                'REDIS_DB': '0',
+                'CELERY_QUEUES': ','.join(
+                    queue_name for worker_config in celery_worker_pools(config_yaml).values()
+                    for queue_name in worker_config['queues']),
+                'METRICS_NAMESPACE': CELERY_METRICS_NAMESPACE,
+                'BACKLOG_METRIC_NAME': CELERY_BACKLOG_METRIC_NAME
+            }
+        )
+
+        events.Rule(
+            self,
+            'BrokerMetricsSchedule',
+            schedule=events.Schedule.rate(cdk.Duration.minutes(amount=1)),
+            targets=[events_targets.LambdaFunction(handler=broker_metrics_lambda)]
+        )
+
+        self.redis = redis
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.celery_broker_redis = celery_broker_redis
+        self.celery_broker_host = celery_broker_host
+
+    def _redis_cluster(self, id: str, description: str, redis_config: dict,
+                       cache_subnet_group_name: str, security_group_id: str) -> tuple:
+        """
+        Creates a Redis node, or a replication group when replicas are configured,
+        with its own parameter group for the configured maxmemory policy.
+        Returns the resource and its host, port and reader host.
+        """
+
+        replicas_per_shard = redis_config['replicas_per_shard']
+
+        parameter_group = ec.CfnParameterGroup(
             self,
-            'RedisCluster',
-            cache_node_type='cache.t3.micro',
+            f'{id}ParameterGroup',
+            cache_parameter_group_family='redis6.x',
+            description=f'Parameter group for {description}',
+            properties={'maxmemory-policy': redis_config['maxmemory_policy']}
+        )
+
+        if replicas_per_shard == 0:
+            redis = ec.CfnCacheCluster(
+                self,
+                f'{id}Cluster',
+                cache_node_type=redis_config['node_type'],
+                engine='redis',
+                engine_version='6.x',
+                num_cache_nodes=1,
+                auto_minor_version_upgrade=True,
+                cache_parameter_group_name=parameter_group.ref,
+                cache_subnet_group_name=cache_subnet_group_name,
+                vpc_security_group_ids=[security_group_id]
+            )
+
+            return redis, redis.attr_redis_endpoint_address, redis.attr_redis_endpoint_port, redis.attr_redis_endpoint_address
+
+        redis = ec.CfnReplicationGroup(
+            self,
+            f'{id}ReplicationGroup',
+            replication_group_description=f'Replication group for {description}',
+            cache_node_type=redis_config['node_type'],
             engine='redis',
             engine_version='6.x',
-            num_cache_nodes=1,
+            cache_parameter_group_name=parameter_group.ref,
+            replicas_per_node_group=replicas_per_shard,
+            automatic_failover_enabled=redis_config['automatic_failover'],
+            multi_az_enabled=redis_config['automatic_failover'],
             auto_minor_version_upgrade=True,
-            cache_subnet_group_name=redis_subnet_group.ref,
-            vpc_security_group_ids=[redis_sg.security_group_id]
+            cache_subnet_group_name=cache_subnet_group_name,
+            security_group_ids=[security_group_id]
         )
 
-        self.redis = redis
+        return redis, redis.attr_primary_end_point_address, redis.attr_primary_end_point_port, redis.attr_reader_end_point_address
@@ -2,8 +2,6 @@
 Compute stack for running ConsoleMe on ECS
 """
 
-import yaml
-
 from aws_cdk import (
     aws_ec2 as ec2,
     aws_ecs as ecs,
@@ -13,10 +11,16 @@ from aws_cdk import (
     aws_iam as iam,
     aws_certificatemanager as acm,
     aws_applicationautoscaling as applicationautoscaling,
+    aws_cloudwatch as cloudwatch,
+    aws_lambda as lambda_,
+    custom_resources as cr,
     core as cdk
 )
 
-from constants import CONTAINER_IMAGE
+from configuration import load_config, celery_worker_pools
+from constants import (
+    CONSOLEME_PORT, CONFIG_VOLUME_NAME, CONFIG_MOUNT_PATH, CELERY_APP, CELERY_METRICS_NAMESPACE, CELERY_QUEUE_LENGTH_METRIC_NAME
+)
 
 
 class ComputeStack(cdk.NestedStack):
@@ -27,12 +31,17 @@ class ComputeStack(cdk.NestedStack):
     def __init__(self, scope: cdk.Construct, id: str,
                  vpc: ec2.Vpc, s3_bucket_name: str, certificate: acm.Certificate,
                  consoleme_alb: lb.ApplicationLoadBalancer, consoleme_sg: ec2.SecurityGroup,
-                 task_role_arn: str, task_execution_role_arn: str, **kwargs) -> None:
+                 task_role_arn: str, task_execution_role_arn: str, config_restart_token: str,
+                 container_image_uri: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
-        config_yaml = yaml.load(open('config.yaml'), Loader=yaml.FullLoader)
+        config_yaml = load_config()
+        task_sizes_config = config_yaml['task_sizes']
+
+        container_image = ecs.ContainerImage.from_registry(container_image_uri)
 
         # ECS Task definition and volumes
+        # Containers carry the configuration restart token, so restart required configuration changes roll the services
 
         imported_task_role = iam.Role.from_role_arn(
             self,
@@ -49,60 +58,169 @@ class ComputeStack(cdk.NestedStack):
         consoleme_ecs_task_definition = ecs.FargateTaskDefinition(
             self,
             'ConsolemeTaskDefinition',
-            cpu=2048,
-            memory_limit_mib=4096,
+            cpu=task_sizes_config['web']['cpu'],
+            memory_limit_mib=task_sizes_config['web']['memory_limit_mib'],
             execution_role=imported_task_execution_role,
             task_role=imported_task_role
         )
 
-        # ECS Container definition, service, target group and ALB attachment
+        # ECS Container definitions, service, target group and ALB attachment
 
-        consoleme_ecs_task_definition.add_container(
-            'Container',
-            image=ecs.ContainerImage.from_registry(CONTAINER_IMAGE),
+        consoleme_containers = self._add_web_containers(
+            consoleme_ecs_task_definition, task_sizes_config['web'], config_yaml['web_processes'],
+            container_image, s3_bucket_name, config_restart_token)
+
+        # Celery beat runs in its own task definition, so periodic jobs are scheduled once
+
+        celery_beat_ecs_task_definition = ecs.FargateTaskDefinition(
+            self,
+            'CeleryBeatTaskDefinition',
+            cpu=task_sizes_config['celery_beat']['cpu'],
+            memory_limit_mib=task_sizes_config['celery_beat']['memory_limit_mib'],
+            execution_role=imported_task_execution_role,
+            task_role=imported_task_role
+        )
+
+        celery_beat_container = celery_beat_ecs_task_definition.add_container(
+            'CeleryBeatContainer',
+            image=container_image,
             privileged=False,
-            port_mappings=[
-                ecs.PortMapping(
-                    container_port=8081,
-                    host_port=8081,
-                    protocol=ecs.Protocol.TCP
-                )
-            ],
+            cpu=task_sizes_config['celery_beat']['container_cpu'],
+            memory_reservation_mib=task_sizes_config['celery_beat']['container_memory_reservation_mib'],
             logging=ecs.LogDriver.aws_logs(
-                stream_prefix='ContainerLogs-',
+                stream_prefix='CeleryBeatContainerLogs-',
                 log_retention=logs.RetentionDays.ONE_WEEK
             ),
             environment={
                 'SETUPTOOLS_USE_DISTUTILS': 'stdlib',
-                'CONSOLEME_CONFIG_S3': 's3://' + s3_bucket_name + '/config.yaml'
+                'CONFIG_LOCATION': CONFIG_MOUNT_PATH + '/config.yaml',
+                'CONSOLEME_CONFIG_RESTART_TOKEN': config_restart_token,
+                'COLUMNS': '80'
             },
-            working_directory='/apps/consoleme',
-            command=[
-                "bash", "-c", "python scripts/retrieve_or_decode_configuration.py; python consoleme/__main__.py"]
+            command=["bash", "-c",
+                     f"exec celery -A {CELERY_APP} beat -l {config_yaml['celery_worker']['log_level']}"]
         )
 
-        consoleme_ecs_task_definition.add_container(
-            'CeleryContainer',
-            image=ecs.ContainerImage.from_registry(CONTAINER_IMAGE),
+        self._add_config_init_container(
+            celery_beat_ecs_task_definition, [celery_beat_container], container_image,
+            s3_bucket_name, config_restart_token)
+
+        # ECS cluster
+
+        cluster = ecs.Cluster(
+            self, 'Cluster',
+            vpc=vpc,
+            enable_fargate_capacity_providers=True
+        )
+
+        # Redis initialization, run once per deployment as a standalone task before the services update
+
+        redis_init_ecs_task_definition = ecs.FargateTaskDefinition(
+            self,
+            'RedisInitTaskDefinition',
+            cpu=512,
+            memory_limit_mib=1024,
+            execution_role=imported_task_execution_role,
+            task_role=imported_task_role
+        )
+
+        redis_init_container = redis_init_ecs_task_definition.add_container(
+            'RedisInitContainer',
+            image=container_image,
             privileged=False,
             logging=ecs.LogDriver.aws_logs(
-                stream_prefix='CeleryContainerLogs-',
+                stream_prefix='RedisInitContainerLogs-',
                 log_retention=logs.RetentionDays.ONE_WEEK
             ),
             environment={
                 'SETUPTOOLS_USE_DISTUTILS': 'stdlib',
-                'CONSOLEME_CONFIG_S3': 's3://' + s3_bucket_name + '/config.yaml',
-                'COLUMNS': '80'
+                'CONFIG_LOCATION': CONFIG_MOUNT_PATH + '/config.yaml',
+                'CONSOLEME_CONFIG_RESTART_TOKEN': config_restart_token
             },
-            command=["bash", "-c",
-                     "python scripts/retrieve_or_decode_configuration.py; python scripts/initialize_redis_oss.py; celery -A consoleme.celery_tasks.celery_tasks worker -l DEBUG -B -E --concurrency=8"]
+            command=["bash", "-c", "python scripts/initialize_redis_oss.py"]
         )
 
-        # ECS cluster
+        self._add_config_init_container(
+            redis_init_ecs_task_definition, [redis_init_container], container_image,
+            s3_bucket_name, config_restart_token)
 
-        cluster = ecs.Cluster(
-            self, 'Cluster',
-            vpc=vpc
+        redis_init_lambda_role = iam.Role(
+            self,
+            'RedisInitLambdaRole',
+            assumed_by=iam.ServicePrincipal(service='lambda.amazonaws.com'),
+            managed_policies=[
+                iam.ManagedPolicy.from_managed_policy_arn(
+                    self,
+                    'RedisInitBasicExecution',
+                    managed_policy_arn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
+                )
+            ]
+        )
+
+        redis_init_lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=['ecs:RunTask'],
+                resources=[redis_init_ecs_task_definition.task_definition_arn]
+            )
+        )
+
+        redis_init_lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=['ecs:DescribeTasks'],
+                resources=['*'],
+                conditions={'ArnEquals': {'ecs:cluster': cluster.cluster_arn}}
+            )
+        )
+
+        redis_init_lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=['iam:PassRole'],
+                resources=[task_role_arn, task_execution_role_arn]
+            )
+        )
+
+        redis_init_lambda_code = lambda_.Code.from_asset('resources/redis_init_lambda', exclude=['__pycache__'])
+
+        redis_init_resource_provider = cr.Provider(
+            self,
+            'RedisInitProvider',
+            on_event_handler=lambda_.Function(
+                self,
+                'RedisInitLambda',
+                code=redis_init_lambda_code,
+                handler='index.on_event',
+                runtime=lambda_.Runtime.PYTHON_3_8,
+                timeout=cdk.Duration.seconds(30),
+                role=redis_init_lambda_role
+            ),
+            is_complete_handler=lambda_.Function(
+                self,
+                'RedisInitCompleteLambda',
+                code=redis_init_lambda_code,
+                handler='index.is_complete',
+                runtime=lambda_.Runtime.PYTHON_3_8,
+                timeout=cdk.Duration.seconds(30),
+                role=redis_init_lambda_role
+            ),
+            query_interval=cdk.Duration.seconds(15),
+            total_timeout=cdk.Duration.minutes(20),
+            log_retention=logs.RetentionDays.ONE_WEEK
+        )
+
+        # A new task definition revision, which includes the configuration restart token, runs the task again
+        redis_init = cdk.CustomResource(
+            self,
+            'RedisInit',
+            service_token=redis_init_resource_provider.service_token,
+            properties={
+                'Cluster': cluster.cluster_arn,
+                'TaskDefinition': redis_init_ecs_task_definition.task_definition_arn,
+                'Subnets': vpc.select_subnets(subnet_type=ec2.SubnetType.PRIVATE).subnet_ids,
+                'SecurityGroups': [consoleme_sg.security_group_id]
+            }
         )
 
         consoleme_imported_alb = lb.ApplicationLoadBalancer.from_application_load_balancer_attributes(
@@ -124,10 +242,35 @@ class ComputeStack(cdk.NestedStack):
             open_listener=False
         )
 
-        consoleme_ecs_service.target_group.configure_health_check(
-            path='/',
-            enabled=True,
-            healthy_http_codes='200-302'
+        # The load balanced service pattern has no capacity provider strategies, so they are set on the service itself
+        consoleme_cfn_service = consoleme_ecs_service.service.node.default_child
+        consoleme_cfn_service.add_property_override('CapacityProviderStrategy', [
+            {'CapacityProvider': strategy.capacity_provider, 'Base': strategy.base, 'Weight': strategy.weight}
+            for strategy in self._capacity_provider_strategies(config_yaml['capacity_providers']['web'])
+        ])
+        consoleme_cfn_service.add_deletion_override('Properties.LaunchType')
+
+        # The pattern registers the first web container, the others are registered on their own ports
+        for consoleme_container in consoleme_containers[1:]:
+            consoleme_ecs_service.target_group.add_target(consoleme_ecs_service.service.load_balancer_target(
+                container_name=consoleme_container.container_name,
+                container_port=consoleme_container.container_port
+            ))
+
+        self._configure_target_group(consoleme_ecs_service.target_group, config_yaml['load_balancing'])
+
+        auto_scale_role = iam.Role(
+            self,
+            'AutoScaleRole',
+            assumed_by=iam.ServicePrincipal(service='ecs-tasks.amazonaws.com'),
+            description='Role for ECS auto scaling group',
+            managed_policies=[
+                iam.ManagedPolicy.from_managed_policy_arn(
+                    self,
+                    'AutoScalingManagedPolicy',
+                    managed_policy_arn='arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceAutoscaleRole'
+                )
+            ]
         )
 
         consoleme_ecs_service_scaling_target = applicationautoscaling.ScalableTarget(
@@ -138,36 +281,466 @@ class ComputeStack(cdk.NestedStack):
             resource_id='service/' + cluster.cluster_name + '/' + consoleme_ecs_service.service.service_name,
             scalable_dimension='ecs:service:DesiredCount',
             service_namespace=applicationautoscaling.ServiceNamespace.ECS,
-            role=iam.Role(
+            role=auto_scale_role
+        )
+
+        consoleme_alb_listener = consoleme_imported_alb.add_listener(
+            'ConsolemeALBListener',
+            protocol=lb.ApplicationProtocol.HTTPS,
+            port=443,
+            certificates=[certificate],
+            default_action=lb.ListenerAction.forward(
+                target_groups=[consoleme_ecs_service.target_group])
+        )
+
+        # Web service scaling on CPU, memory and ALB requests per task, scaling in slower than out to avoid thrashing
+
+        web_autoscaling_config = config_yaml['web_autoscaling']
+        scale_in_cooldown = cdk.Duration.seconds(amount=web_autoscaling_config['scale_in_cooldown_seconds'])
+        scale_out_cooldown = cdk.Duration.seconds(amount=web_autoscaling_config['scale_out_cooldown_seconds'])
+
+        target_tracking_policies = {
+            'AutoScalingPolicy': (
+                'cpu_target', applicationautoscaling.PredefinedMetric.ECS_SERVICE_AVERAGE_CPU_UTILIZATION, None),
+            'MemoryAutoScalingPolicy': (
+                'memory_target', applicationautoscaling.PredefinedMetric.ECS_SERVICE_AVERAGE_MEMORY_UTILIZATION, None),
+            'RequestCountAutoScalingPolicy': (
+                'requests_per_target', applicationautoscaling.PredefinedMetric.ALB_REQUEST_COUNT_PER_TARGET,
+                consoleme_ecs_service.target_group.first_load_balancer_full_name + '/'
+                + consoleme_ecs_service.target_group.target_group_full_name)
+        }
+
+        for policy_id, (config_key, predefined_metric, resource_label) in target_tracking_policies.items():
+            if web_autoscaling_config.get(config_key):
+                applicationautoscaling.TargetTrackingScalingPolicy(
+                    self,
+                    policy_id,
+                    scaling_target=consoleme_ecs_service_scaling_target,
+                    scale_in_cooldown=scale_in_cooldown,
+                    scale_out_cooldown=scale_out_cooldown,
+                    target_value=web_autoscaling_config[config_key],
+                    predefined_metric=predefined_metric,
+                    resource_label=resource_label
+                )
+
+        # Target tracking does not support percentiles, so the p95 latency scales out in steps instead
+
+        if web_autoscaling_config.get('p95_latency_seconds'):
+            p95_latency_seconds = web_autoscaling_config['p95_latency_seconds']
+
+            applicationautoscaling.StepScalingPolicy(
+                self,
+                'LatencyAutoScalingPolicy',
+                scaling_target=consoleme_ecs_service_scaling_target,
+                metric=consoleme_ecs_service.target_group.metric_target_response_time(
+                    statistic='p95', period=cdk.Duration.minutes(amount=1)),
+                adjustment_type=applicationautoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+                cooldown=scale_out_cooldown,
+                evaluation_periods=2,
+                scaling_steps=[
+                    applicationautoscaling.ScalingInterval(upper=p95_latency_seconds, change=0),
+                    applicationautoscaling.ScalingInterval(lower=p95_latency_seconds, change=+1),
+                    applicationautoscaling.ScalingInterval(lower=p95_latency_seconds * 2, change=+3)
+                ]
+            )
+
+        for scheduled_scaling in web_autoscaling_config.get('scheduled', []):
+            consoleme_ecs_service_scaling_target.scale_on_schedule(
+                scheduled_scaling['name'],
+                schedule=applicationautoscaling.Schedule.expression(scheduled_scaling['schedule']),
+                min_capacity=scheduled_scaling['min_capacity'],
+                max_capacity=scheduled_scaling['max_capacity']
+            )
+
+        # Path groups, such as the CLI credentials API, run as separately sized and scaled services,
+        # which the listener routes their paths to ahead of the web service
+
+        path_routing_ecs_services = []
+
+        for index, (group_name, path_group_config) in enumerate(config_yaml['path_routing'].items()):
+            construct_prefix = group_name.title().replace('_', '')
+
+            path_group_task_definition = ecs.FargateTaskDefinition(
+                self,
+                construct_prefix + 'TaskDefinition',
+                cpu=path_group_config['task_size']['cpu'],
+                memory_limit_mib=path_group_config['task_size']['memory_limit_mib'],
+                execution_role=imported_task_execution_role,
+                task_role=imported_task_role
+            )
+
+            path_group_containers = self._add_web_containers(
+                path_group_task_definition, path_group_config['task_size'], path_group_config['web_processes'],
+                container_image, s3_bucket_name, config_restart_token)
+
+            path_group_ecs_service = ecs.FargateService(
+                self,
+                construct_prefix + 'Service',
+                cluster=cluster,
+                task_definition=path_group_task_definition,
+                capacity_provider_strategies=self._capacity_provider_strategies(
+                    config_yaml['capacity_providers']['web']),
+                security_groups=[consoleme_sg],
+                desired_count=path_group_config['min_capacity']
+            )
+
+            path_group_target_group = lb.ApplicationTargetGroup(
+                self,
+                construct_prefix + 'TargetGroup',
+                vpc=vpc,
+                port=CONSOLEME_PORT,
+                protocol=lb.ApplicationProtocol.HTTP,
+                target_type=lb.TargetType.IP,
+                targets=[
+                    path_group_ecs_service.load_balancer_target(
+                        container_name=container.container_name,
+                        container_port=container.container_port
+                    )
+                    for container in path_group_containers
+                ]
+            )
+
+            self._configure_target_group(path_group_target_group, config_yaml['load_balancing'])
+
+            consoleme_alb_listener.add_target_groups(
+                construct_prefix + 'TargetGroups',
+                target_groups=[path_group_target_group],
+                priority=(index + 1) * 10,
+                conditions=[lb.ListenerCondition.path_patterns(path_group_config['paths'])]
+            )
+
+            path_group_scaling_target = applicationautoscaling.ScalableTarget(
                 self,
-                'AutoScaleRole',
-                assumed_by=iam.ServicePrincipal(service='ecs-tasks.amazonaws.com'),
-                description='Role for ECS auto scaling group',
-                managed_policies=[
-                    iam.ManagedPolicy.from_managed_policy_arn(
+                construct_prefix + 'AutoScalingGroup',
+                max_capacity=path_group_config['max_capacity'],
+                min_capacity=path_group_config['min_capacity'],
+                resource_id='service/' + cluster.cluster_name + '/' + path_group_ecs_service.service_name,
+                scalable_dimension='ecs:service:DesiredCount',
+                service_namespace=applicationautoscaling.ServiceNamespace.ECS,
+                role=auto_scale_role
+            )
+
+            path_group_target_tracking_policies = {
+                construct_prefix + 'AutoScalingPolicy': (
+                    'cpu_target', applicationautoscaling.PredefinedMetric.ECS_SERVICE_AVERAGE_CPU_UTILIZATION, None),
+                construct_prefix + 'RequestCountAutoScalingPolicy': (
+                    'requests_per_target', applicationautoscaling.PredefinedMetric.ALB_REQUEST_COUNT_PER_TARGET,
+                    path_group_target_group.first_load_balancer_full_name + '/'
+                    + path_group_target_group.target_group_full_name)
+            }
+
+            for policy_id, (config_key, predefined_metric, resource_label) in \
+                    path_group_target_tracking_policies.items():
+                if path_group_config.get(config_key):
+                    applicationautoscaling.TargetTrackingScalingPolicy(
                         self,
-                        'AutoScalingManagedPolicy',
-                        managed_policy_arn='arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceAutoscaleRole'
+                        policy_id,
+                        scaling_target=path_group_scaling_target,
+                        scale_in_cooldown=scale_in_cooldown,
+                        scale_out_cooldown=scale_out_cooldown,
+                        target_value=path_group_config[config_key],
+                        predefined_metric=predefined_metric,
+                        resource_label=resource_label
                     )
+
+            path_routing_ecs_services.append(path_group_ecs_service)
+
+        # Celery worker pools, each a service consuming its own queues and scaled on their backlog instead of web CPU
+
+        celery_ecs_services = {}
+
+        for pool_name, celery_worker_config in celery_worker_pools(config_yaml).items():
+            # The default pool keeps the construct ids it had before worker pools existed
+            construct_prefix = 'Celery' if pool_name == 'default' \
+                else 'Celery' + pool_name.title().replace('_', '')
+
+            celery_ecs_task_definition = ecs.FargateTaskDefinition(
+                self,
+                construct_prefix + 'TaskDefinition',
+                cpu=task_sizes_config['celery_worker']['cpu'],
+                memory_limit_mib=task_sizes_config['celery_worker']['memory_limit_mib'],
+                execution_role=imported_task_execution_role,
+                task_role=imported_task_role
+            )
+
+            celery_container = celery_ecs_task_definition.add_container(
+                construct_prefix + 'Container',
+                image=container_image,
+                privileged=False,
+                cpu=task_sizes_config['celery_worker']['container_cpu'],
+                memory_reservation_mib=task_sizes_config['celery_worker']['container_memory_reservation_mib'],
+                logging=ecs.LogDriver.aws_logs(
+                    stream_prefix=construct_prefix + 'ContainerLogs-',
+                    log_retention=logs.RetentionDays.ONE_WEEK
+                ),
+                environment={
+                    'SETUPTOOLS_USE_DISTUTILS': 'stdlib',
+                    'CONFIG_LOCATION': CONFIG_MOUNT_PATH + '/config.yaml',
+                    'CONSOLEME_CONFIG_RESTART_TOKEN': config_restart_token,
+                    'COLUMNS': '80'
+                },
+                # Celery warm shuts down on SIGTERM, finishing the running tasks within the Fargate Spot notice
+                stop_timeout=cdk.Duration.seconds(amount=120),
+                command=["bash", "-c", self._celery_worker_command(celery_worker_config)]
+            )
+
+            self._add_config_init_container(
+                celery_ecs_task_definition, [celery_container], container_image,
+                s3_bucket_name, config_restart_token)
+
+            celery_ecs_service = ecs.FargateService(
+                self,
+                construct_prefix + 'Service',
+                cluster=cluster,
+                task_definition=celery_ecs_task_definition,
+                capacity_provider_strategies=self._capacity_provider_strategies(
+                    config_yaml['capacity_providers']['celery_worker']),
+                security_groups=[consoleme_sg],
+                desired_count=celery_worker_config['min_capacity']
+            )
+
+            celery_ecs_service_scaling_target = applicationautoscaling.ScalableTarget(
+                self,
+                construct_prefix + 'AutoScalingGroup',
+                max_capacity=celery_worker_config['max_capacity'],
+                min_capacity=celery_worker_config['min_capacity'],
+                resource_id='service/' + cluster.cluster_name + '/' + celery_ecs_service.service_name,
+                scalable_dimension='ecs:service:DesiredCount',
+                service_namespace=applicationautoscaling.ServiceNamespace.ECS,
+                role=auto_scale_role
+            )
+
+            applicationautoscaling.StepScalingPolicy(
+                self,
+                construct_prefix + 'AutoScalingPolicy',
+                scaling_target=celery_ecs_service_scaling_target,
+                metric=self._celery_backlog_metric(celery_worker_config['queues']),
+                adjustment_type=applicationautoscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+                cooldown=cdk.Duration.seconds(amount=celery_worker_config['cooldown_seconds']),
+                scaling_steps=[
+                    applicationautoscaling.ScalingInterval(
+                        upper=celery_worker_config['scale_in_backlog'], change=-1),
+                    applicationautoscaling.ScalingInterval(
+                        lower=celery_worker_config['scale_out_backlog'], change=+1),
+                    applicationautoscaling.ScalingInterval(
+                        lower=celery_worker_config['scale_out_backlog'] * 5, change=+3)
                 ]
             )
-        )
 
-        applicationautoscaling.TargetTrackingScalingPolicy(
+            celery_ecs_services[pool_name] = celery_ecs_service
+
+        # Celery beat service, a single task which is stopped before its replacement starts
+
+        celery_beat_ecs_service = ecs.FargateService(
             self,
-            'AutoScalingPolicy',
-            scaling_target=consoleme_ecs_service_scaling_target,
-            scale_in_cooldown=cdk.Duration.seconds(amount=10),
-            scale_out_cooldown=cdk.Duration.seconds(amount=10),
-            target_value=50,
-            predefined_metric=applicationautoscaling.PredefinedMetric.ECS_SERVICE_AVERAGE_CPU_UTILIZATION
+            'CeleryBeatService',
+            cluster=cluster,
+            task_definition=celery_beat_ecs_task_definition,
+            security_groups=[consoleme_sg],
+            desired_count=1,
+            min_healthy_percent=0,
+            max_healthy_percent=100
         )
 
-        consoleme_imported_alb.add_listener(
-            'ConsolemeALBListener',
-            protocol=lb.ApplicationProtocol.HTTPS,
-            port=443,
-            certificates=[certificate],
-            default_action=lb.ListenerAction.forward(
-                target_groups=[consoleme_ecs_service.target_group])
+        ecs_services = [consoleme_ecs_service.service, celery_beat_ecs_service, *celery_ecs_services.values(),
+                        *path_routing_ecs_services]
+
+        for ecs_service in ecs_services:
+            ecs_service.node.add_dependency(redis_init)
+
+        self.cluster = cluster
+        self.celery_ecs_services = celery_ecs_services
+
+    @staticmethod
+    def _configure_target_group(target_group: lb.ApplicationTargetGroup, load_balancing_config: dict) -> None:
+        """
+        Health checks the targets on the lightweight health endpoint, drains them for the configured delay,
+        and sets how requests are spread over them
+        """
+        health_check_config = load_balancing_config['health_check']
+
+        target_group.configure_health_check(
+            path=health_check_config['path'],
+            enabled=True,
+            healthy_http_codes=health_check_config['healthy_http_codes'],
+            interval=cdk.Duration.seconds(amount=health_check_config['interval_seconds']),
+            timeout=cdk.Duration.seconds(amount=health_check_config['timeout_seconds']),
+            healthy_threshold_count=health_check_config['healthy_threshold_count'],
+            unhealthy_threshold_count=health_check_config['unhealthy_threshold_count']
+        )
+
+        target_group.set_attribute(
+            'deregistration_delay.timeout_seconds', str(load_balancing_config['deregistration_delay_seconds']))
+
+        # Slow start ramps up new tasks while they are cold, and is not supported with least outstanding requests
+        if load_balancing_config.get('slow_start_seconds'):
+            target_group.set_attribute('slow_start.duration_seconds', str(load_balancing_config['slow_start_seconds']))
+
+        target_group.set_attribute(
+            'load_balancing.algorithm.type',
+            'least_outstanding_requests' if load_balancing_config.get('least_outstanding_requests') else 'round_robin')
+
+    @staticmethod
+    def _celery_backlog_metric(queue_names: list) -> cloudwatch.IMetric:
+        """
+        Returns the summed length of the queues a worker pool consumes, as published by the broker metrics lambda
+        """
+        queue_length_metrics = {
+            'queue' + str(index): cloudwatch.Metric(
+                namespace=CELERY_METRICS_NAMESPACE,
+                metric_name=CELERY_QUEUE_LENGTH_METRIC_NAME,
+                dimensions_map={'Queue': queue_name},
+                statistic='Maximum',
+                period=cdk.Duration.minutes(amount=1)
+            )
+            for index, queue_name in enumerate(queue_names)
+        }
+
+        if len(queue_length_metrics) == 1:
+            return queue_length_metrics['queue0']
+
+        return cloudwatch.MathExpression(
+            expression=' + '.join(queue_length_metrics),
+            using_metrics=queue_length_metrics,
+            period=cdk.Duration.minutes(amount=1)
+        )
+
+    @staticmethod
+    def _celery_worker_command(worker_config: dict) -> str:
+        """
+        Returns the Celery worker command for the pool queues, the configured pool, concurrency or autoscale bounds,
+        and prefetching
+        """
+        command = [
+            'exec celery', '-A', CELERY_APP, 'worker', '-E',
+            '-Q', ','.join(worker_config['queues']),
+            '-l', worker_config['log_level'],
+            '--pool=' + worker_config['pool'],
+            '--prefetch-multiplier=' + str(worker_config['prefetch_multiplier'])
+        ]
+
+        if worker_config.get('autoscale'):
+            command.append(f"--autoscale={worker_config['autoscale']['max']},{worker_config['autoscale']['min']}")
+        else:
+            command.append('--concurrency=' + str(worker_config['concurrency']))
+
+        # Only the prefork pool recycles its child processes
+        if worker_config['pool'] == 'prefork' and worker_config.get('max_tasks_per_child'):
+            command.append('--max-tasks-per-child=' + str(worker_config['max_tasks_per_child']))
+
+        return ' '.join(command)
+
+    @staticmethod
+    def _capacity_provider_strategies(strategy_config: list) -> list:
+        """
+        Returns the capacity provider strategies of a service, such as a base of on demand tasks with the rest on Spot
+        """
+        return [
+            ecs.CapacityProviderStrategy(
+                capacity_provider=strategy['capacity_provider'],
+                base=strategy.get('base', 0),
+                weight=strategy.get('weight', 0)
+            )
+            for strategy in strategy_config
+        ]
+
+    def _add_web_containers(self, task_definition: ecs.FargateTaskDefinition, task_size: dict, web_processes: int,
+                            container_image: ecs.ContainerImage, s3_bucket_name: str,
+                            config_restart_token: str) -> list:
+        """
+        Adds the ConsoleMe containers of a web task. Tornado serves requests on a single core,
+        so each web process runs in its own container on its own port, sharing the task reservations
+        """
+
+        web_ports = [CONSOLEME_PORT + index for index in range(web_processes)]
+        consoleme_containers = []
+
+        for index, web_port in enumerate(web_ports):
+            consoleme_containers.append(task_definition.add_container(
+                'Container' if index == 0 else 'Container' + str(index + 1),
+                image=container_image,
+                privileged=False,
+                cpu=task_size['container_cpu'] // web_processes,
+                memory_reservation_mib=task_size['container_memory_reservation_mib'] // web_processes,
+                port_mappings=[
+                    ecs.PortMapping(
+                        container_port=web_port,
+                        host_port=web_port,
+                        protocol=ecs.Protocol.TCP
+                    )
+                ],
+                logging=ecs.LogDriver.aws_logs(
+                    stream_prefix='ContainerLogs-',
+                    log_retention=logs.RetentionDays.ONE_WEEK
+                ),
+                environment={
+                    'SETUPTOOLS_USE_DISTUTILS': 'stdlib',
+                    'CONFIG_LOCATION': CONFIG_MOUNT_PATH + (
+                        '/config.yaml' if web_port == CONSOLEME_PORT else f'/config-{web_port}.yaml'),
+                    'CONSOLEME_CONFIG_RESTART_TOKEN': config_restart_token
+                },
+                working_directory='/apps/consoleme',
+                command=[
+                    "bash", "-c", "python consoleme/__main__.py"]
+            ))
+
+        self._add_config_init_container(
+            task_definition, consoleme_containers, container_image,
+            s3_bucket_name, config_restart_token, web_ports=web_ports[1:])
+
+        return consoleme_containers
+
+    def _add_config_init_container(self, task_definition: ecs.FargateTaskDefinition,
+                                   app_containers: list, container_image: ecs.ContainerImage,
+                                   s3_bucket_name: str, config_restart_token: str,
+                                   web_ports: list = ()) -> ecs.ContainerDefinition:
+        """
+        Adds a container fetching the configuration file once per task into a task scoped volume,
+        which the application containers read after the fetch succeeded.
+        A copy listening on each of the web_ports is written next to it, for the additional web containers
+        """
+
+        task_definition.add_volume(name=CONFIG_VOLUME_NAME)
+
+        config_init_environment = {
+            'CONSOLEME_CONFIG_BUCKET': s3_bucket_name,
+            'CONFIG_LOCATION': CONFIG_MOUNT_PATH + '/config.yaml',
+            'CONSOLEME_CONFIG_RESTART_TOKEN': config_restart_token
+        }
+        config_init_code = ("import os, boto3; boto3.client('s3').download_file("
+                            "os.environ['CONSOLEME_CONFIG_BUCKET'], 'config.yaml', os.environ['CONFIG_LOCATION'])")
+
+        # The configuration file is written as JSON, so the copies need nothing besides the standard library
+        if web_ports:
+            config_init_environment['CONSOLEME_WEB_PORTS'] = ','.join(str(web_port) for web_port in web_ports)
+            config_init_code += (
+                "\nimport json"
+                "\nconfig = json.load(open(os.environ['CONFIG_LOCATION']))"
+                "\nfor port in os.environ['CONSOLEME_WEB_PORTS'].split(','):"
+                "\n    config['tornado']['port'] = int(port)"
+                "\n    with open(os.path.join(os.path.dirname(os.environ['CONFIG_LOCATION']),"
+                " 'config-' + port + '.yaml'), 'w') as config_file:"
+                "\n        json.dump(config, config_file)")
+
+        config_init_container = task_definition.add_container(
+            'ConfigInitContainer',
+            image=container_image,
+            privileged=False,
+            essential=False,
+            logging=ecs.LogDriver.aws_logs(
+                stream_prefix='ConfigInitContainerLogs-',
+                log_retention=logs.RetentionDays.ONE_WEEK
+            ),
+            environment=config_init_environment,
+            command=["python", "-c", config_init_code]
         )
+
+        config_init_container.add_mount_points(ecs.MountPoint(
+            container_path=CONFIG_MOUNT_PATH, source_volume=CONFIG_VOLUME_NAME, read_only=False))
+        for app_container in app_containers:
+            app_container.add_mount_points(ecs.MountPoint(
+                container_path=CONFIG_MOUNT_PATH, source_volume=CONFIG_VOLUME_NAME, read_only=True))
+            app_container.add_container_dependencies(ecs.ContainerDependency(
+                container=config_init_container, condition=ecs.ContainerDependencyCondition.SUCCESS))
+
+        return config_init_container
@@ -2,20 +2,132 @@
 Configuration stack for running ConsoleMe on ECS
 """
 
-from uuid import uuid4
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+
+import jsii
 import yaml
 
 from aws_cdk import (
     aws_cognito as cognito,
+    aws_events as events,
+    aws_events_targets as events_targets,
     aws_lambda as lambda_,
     aws_iam as iam,
     custom_resources as cr,
     aws_logs as logs,
-    aws_elasticache as ec,
     core as cdk
 )
 
-from aws_cdk.aws_lambda_python import PythonFunction as lambda_python
+from configuration import load_config, celery_worker_pools
+
+CREATE_CONFIGURATION_LAMBDA_ENTRY = 'resources/create_config_lambda'
+CREATE_CONFIGURATION_LAMBDA_PACKAGES = ['dictdiffer']
+CONFIG_TEMPLATE_FILE = 'resources/consoleme_config/config.yaml'
+
+# Secrets are left out of the custom resource properties, which are logged by the provider framework
+SECRET_INPUTS = ['JWT_SECRET', 'OIDC_CLIENT_SECRET']
+
+
+@jsii.implements(cdk.ILocalBundling)
+class LocalPackagesBundling:
+    """
+    Bundles the lambda code with the pure Python packages installed next to the CDK app,
+    so synth only falls back to Docker bundling when a package is missing
+    """
+
+    def __init__(self, entry: str, packages: list) -> None:
+        self.entry = entry
+        self.packages = packages
+
+    def try_bundle(self, output_dir: str, options: cdk.BundlingOptions) -> bool:
+        package_specs = [importlib.util.find_spec(package) for package in self.packages]
+        if None in package_specs:
+            return False
+
+        ignore = shutil.ignore_patterns('__pycache__')
+        shutil.copytree(self.entry, output_dir, ignore=ignore, dirs_exist_ok=True)
+        for package_spec in package_specs:
+            if package_spec.submodule_search_locations:
+                package_path = list(package_spec.submodule_search_locations)[0]
+                shutil.copytree(package_path, os.path.join(output_dir, os.path.basename(package_path)),
+                                ignore=ignore, dirs_exist_ok=True)
+            else:
+                shutil.copy(package_spec.origin, output_dir)
+
+        return True
+
+
+def config_hash(environment: dict) -> str:
+    """
+    Returns a stable hash of the lambda inputs known at synth time, such as the secrets left out of the rendered
+    configuration, and of the lambda code, so the configuration file is only rewritten when one of them changes
+    """
+
+    config_inputs = hashlib.sha256()
+
+    for file_name in sorted(os.listdir(CREATE_CONFIGURATION_LAMBDA_ENTRY)):
+        file_path = os.path.join(CREATE_CONFIGURATION_LAMBDA_ENTRY, file_name)
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as lambda_file:
+                config_inputs.update(file_name.encode('utf-8') + lambda_file.read())
+
+    config_inputs.update(json.dumps(
+        {key: value for key, value in environment.items() if not cdk.Token.is_unresolved(value)},
+        sort_keys=True).encode('utf-8'))
+
+    return config_inputs.hexdigest()
+
+
+def config_deploy_time_inputs(environment: dict) -> dict:
+    """
+    Returns the configuration inputs resolved at deploy time, such as the Redis endpoints,
+    so a change to any of them updates the configuration file as well
+    """
+
+    return {key: value for key, value in environment.items()
+            if cdk.Token.is_unresolved(value) and key not in SECRET_INPUTS}
+
+
+def celery_task_routes(config_yaml: dict) -> dict:
+    """
+    Returns the Celery task routes sending the tasks of each worker pool to its first queue,
+    while any other task goes to the default queue
+    """
+
+    return {task_pattern: {'queue': worker_config['queues'][0]}
+            for worker_config in celery_worker_pools(config_yaml).values()
+            for task_pattern in worker_config.get('tasks', [])}
+
+
+def render_config(config_values: dict, spoke_accounts: list, task_routes: dict = None) -> dict:
+    """
+    Returns the ConsoleMe configuration rendered from the template at synth time. Values resolved at deploy time,
+    and secrets, are left as ${NAME} placeholders which the configuration lambda fills in from its environment
+    """
+
+    template_values = {
+        key.lower(): '${' + key + '}' if cdk.Token.is_unresolved(value) or key in SECRET_INPUTS else value
+        for key, value in config_values.items()
+    }
+
+    with open(CONFIG_TEMPLATE_FILE) as config_template:
+        config = yaml.safe_load(config_template.read().format(**template_values))
+
+    config['account_ids_to_name'] = {account_id: ['account_' + account_id] for account_id in spoke_accounts}
+    config['account_ids_to_name'].setdefault(
+        template_values['account_number'], ['account_' + template_values['account_number']])
+
+    if config_values.get('DAX_ENDPOINT'):
+        config['dax'] = {'endpoint': template_values['dax_endpoint']}
+
+    if task_routes:
+        config['celery']['task_routes'] = task_routes
+
+    return config
 
 
 class ConfigStack(cdk.NestedStack):
@@ -26,11 +138,13 @@ class ConfigStack(cdk.NestedStack):
     def __init__(self, scope: cdk.Construct, id: str,
                  cognito_user_pool: cognito.UserPool, s3_bucket_name: str,
                  create_configuration_lambda_role_arn: str,
-                 redis: ec.CfnCacheCluster, domain_name: str, **kwargs) -> None:
+                 redis_host: str, celery_broker_host: str,
+                 dax_endpoint: str, domain_name: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
-        config_yaml = yaml.load(open('config.yaml'), Loader=yaml.FullLoader)
+        config_yaml = load_config()
         spoke_accounts = config_yaml['spoke_accounts']
+        spoke_accounts_discovery_config = config_yaml['spoke_accounts_discovery']
 
         cognito_user_pool_client = cognito.UserPoolClient(
             self,
@@ -88,27 +202,53 @@ class ConfigStack(cdk.NestedStack):
 
         jwt_secret = config_yaml['jwt_secret']
 
-        create_configuration_lambda = lambda_python(
+        config_values = {
+            'ISSUER': domain_name,
+            'JWT_SECRET': jwt_secret,
+            'OIDC_CLIENT_ID': cognito_user_pool_client.user_pool_client_id,
+            'OIDC_CLIENT_SECRET': cognito_user_pool_client_secret,
+            'OIDC_METADATA_URL': 'https://cognito-idp.' + self.region + '.amazonaws.com/' + cognito_user_pool.user_pool_id + '/.well-known/openid-configuration',
+            'REDIS_HOST': redis_host,
+            'CELERY_BROKER_HOST': celery_broker_host,
+            'AWS_REGION': self.region,
+            'SES_IDENTITY_ARN': 'arn:aws:ses:' + self.region + ':' + self.account + ':identity/' + domain_name,
+            'SUPPORT_CHAT_URL': 'https://discord.gg/nQVpNGGkYu',
+            'APPLICATION_ADMIN': 'consoleme_admin',
+            'ACCOUNT_NUMBER': self.account,
+            'DAX_ENDPOINT': dax_endpoint or ''
+        }
+
+        # Only the placeholders are filled in by the lambda, AWS_REGION is set by the lambda runtime itself
+        create_configuration_lambda_environment = {
+            key: value for key, value in config_values.items()
+            if (cdk.Token.is_unresolved(value) or key in SECRET_INPUTS) and key != 'AWS_REGION'
+        }
+        create_configuration_lambda_environment.update({
+            'DEPLOYMENT_BUCKET': s3_bucket_name,
+            'ACCOUNT_NUMBER': self.account,
+            'SPOKE_ACCOUNTS_SOURCE': spoke_accounts_discovery_config['source'],
+            'SPOKE_ACCOUNTS_MANIFEST_KEY': spoke_accounts_discovery_config.get('manifest_key', '')
+        })
+
+        create_configuration_lambda = lambda_.Function(
             self,
             'CreateConfigurationFileLambda',
-            entry='resources/create_config_lambda',
-            timeout=cdk.Duration.seconds(30),
+            code=lambda_.Code.from_asset(
+                CREATE_CONFIGURATION_LAMBDA_ENTRY,
+                bundling=cdk.BundlingOptions(
+                    image=lambda_.Runtime.PYTHON_3_8.bundling_image,
+                    command=['bash', '-c', 'pip install ' + ' '.join(CREATE_CONFIGURATION_LAMBDA_PACKAGES)
+                             + ' -t /asset-output && cp -au . /asset-output'],
+                    local=LocalPackagesBundling(CREATE_CONFIGURATION_LAMBDA_ENTRY,
+                                                CREATE_CONFIGURATION_LAMBDA_PACKAGES)
+                )
+            ),
+            handler='index.handler',
+            timeout=cdk.Duration.seconds(300),
+            memory_size=512,
             runtime=lambda_.Runtime.PYTHON_3_8,
             role=imported_create_configuration_lambda_role,
-            environment={
-                'DEPLOYMENT_BUCKET': s3_bucket_name,
-                'JWT_SECRET': jwt_secret,
-                'OIDC_CLIENT_ID': cognito_user_pool_client.user_pool_client_id,
-                'OIDC_CLIENT_SECRET': cognito_user_pool_client_secret,
-                'OIDC_METADATA_URL': 'https://cognito-idp.' + self.region + '.amazonaws.com/' + cognito_user_pool.user_pool_id + '/.well-known/openid-configuration',
-                'REDIS_HOST': redis.attr_redis_endpoint_address,
-                'SES_IDENTITY_ARN': 'arn:aws:ses:' + self.region + ':' + self.account + ':identity/' + domain_name,
-                'SUPPORT_CHAT_URL': 'https://discord.gg/nQVpNGGkYu',
-                'APPLICATION_ADMIN': 'consoleme_admin',
-                'ACCOUNT_NUMBER': self.account,
-                'ISSUER': domain_name,
-                'SPOKE_ACCOUNTS': ','.join(spoke_accounts)
-            }
+            environment=create_configuration_lambda_environment
         )
 
         create_configuration_resource_provider = cr.Provider(
@@ -118,10 +258,33 @@ class ConfigStack(cdk.NestedStack):
             log_retention=logs.RetentionDays.ONE_WEEK
         )
 
-        cdk.CustomResource(
+        create_configuration_resource = cdk.CustomResource(
             self,
             'CreateConfigurationFile',
             service_token=create_configuration_resource_provider.service_token,
             removal_policy=cdk.RemovalPolicy.DESTROY,
-            properties={'UUID': str(uuid4())}
+            properties=dict(
+                config_deploy_time_inputs(create_configuration_lambda_environment),
+                ConfigHash=config_hash(create_configuration_lambda_environment),
+                Config=json.dumps(render_config(
+                    config_values,
+                    spoke_accounts if spoke_accounts_discovery_config['source'] == 'config' else [],
+                    celery_task_routes(config_yaml)))
+            )
         )
+
+        # Discovered accounts change between deploys, which leave the configuration file custom resource untouched,
+        # so the configuration lambda rediscovers them on a schedule into the hot reloaded configuration file
+
+        if spoke_accounts_discovery_config['source'] != 'config':
+            events.Rule(
+                self,
+                'ConfigurationRefreshSchedule',
+                schedule=events.Schedule.expression(spoke_accounts_discovery_config['refresh_schedule']),
+                targets=[events_targets.LambdaFunction(
+                    handler=create_configuration_lambda,
+                    event=events.RuleTargetInput.from_object({'RequestType': 'Refresh'})
+                )]
+            )
+
+        self.config_restart_token = create_configuration_resource.get_att_string('RestartToken')
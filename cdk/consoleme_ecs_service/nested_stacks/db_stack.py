@@ -3,22 +3,33 @@ Database stack for running ConsoleMe on ECS
 """
 
 from aws_cdk import (
+    aws_dax as dax,
     aws_dynamodb as db,
+    aws_ec2 as ec2,
+    aws_iam as iam,
     core as cdk
 )
 
+from configuration import load_config
+from constants import DAX_CLUSTER_NAME
+
 
 class DBStack(cdk.NestedStack):
     """
     Database stack for running ConsoleMe on ECS
     """
 
-    def __init__(self, scope: cdk.Construct, id: str, **kwargs) -> None:
+    def __init__(self, scope: cdk.Construct, id: str,
+                 vpc: ec2.Vpc, dax_sg: ec2.SecurityGroup, dax_service_role: iam.Role, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        config_yaml = load_config()
+        tables_config = config_yaml['dynamodb_tables']
+        self.target_utilization = config_yaml['dynamodb_target_utilization']
+
         # DynamoDB tables
 
-        db.Table(
+        iam_roles_table = db.Table(
             self,
             'IAMRolesTable',
             table_name='consoleme_iamroles_global',
@@ -26,24 +37,26 @@ class DBStack(cdk.NestedStack):
                 name='arn', type=db.AttributeType.STRING),
             sort_key=db.Attribute(
                 name='accountId', type=db.AttributeType.STRING),
-            billing_mode=db.BillingMode.PROVISIONED,
-            read_capacity=100,
-            write_capacity=100,
-            removal_policy=cdk.RemovalPolicy.DESTROY
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute=tables_config['consoleme_iamroles_global'].get('ttl_attribute'),
+            **self._table_capacity(tables_config['consoleme_iamroles_global'])
         )
 
-        db.Table(
+        self._auto_scale_table(iam_roles_table, tables_config['consoleme_iamroles_global'])
+
+        config_table = db.Table(
             self,
             'ConfigTable',
             table_name='consoleme_config_global',
             partition_key=db.Attribute(
                 name='id', type=db.AttributeType.STRING),
-            billing_mode=db.BillingMode.PROVISIONED,
-            read_capacity=10,
-            write_capacity=10,
-            removal_policy=cdk.RemovalPolicy.DESTROY
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute=tables_config['consoleme_config_global'].get('ttl_attribute'),
+            **self._table_capacity(tables_config['consoleme_config_global'])
         )
 
+        self._auto_scale_table(config_table, tables_config['consoleme_config_global'])
+
         requests_table = db.Table(
             self,
             'RequestsTable',
@@ -51,21 +64,21 @@ class DBStack(cdk.NestedStack):
             partition_key=db.Attribute(
                 name='request_id', type=db.AttributeType.STRING),
             sort_key=db.Attribute(name='arn', type=db.AttributeType.STRING),
-            billing_mode=db.BillingMode.PROVISIONED,
-            read_capacity=10,
-            write_capacity=10,
-            removal_policy=cdk.RemovalPolicy.DESTROY
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute=tables_config['consoleme_policy_requests'].get('ttl_attribute'),
+            **self._table_capacity(tables_config['consoleme_policy_requests'])
         )
 
         requests_table.add_global_secondary_index(
             index_name='arn-request_id-index',
             partition_key=db.Attribute(
                 name='arn', type=db.AttributeType.STRING),
-            read_capacity=123,
-            write_capacity=123,
-            projection_type=db.ProjectionType.ALL
+            **self._index_projection(tables_config['consoleme_policy_requests'], 'arn-request_id-index'),
+            **self._table_capacity(tables_config['consoleme_policy_requests'], 'arn-request_id-index')
         )
 
+        self._auto_scale_table(requests_table, tables_config['consoleme_policy_requests'])
+
         cache_table = db.Table(
             self,
             'CacheTable',
@@ -74,22 +87,22 @@ class DBStack(cdk.NestedStack):
                 name='resourceId', type=db.AttributeType.STRING),
             sort_key=db.Attribute(name='resourceType',
                                   type=db.AttributeType.STRING),
-            billing_mode=db.BillingMode.PROVISIONED,
-            read_capacity=10,
-            write_capacity=10,
-            removal_policy=cdk.RemovalPolicy.DESTROY
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute=tables_config['consoleme_resource_cache'].get('ttl_attribute'),
+            **self._table_capacity(tables_config['consoleme_resource_cache'])
         )
 
         cache_table.add_global_secondary_index(
             index_name='arn-index',
             partition_key=db.Attribute(
                 name='arn', type=db.AttributeType.STRING),
-            read_capacity=123,
-            write_capacity=123,
-            projection_type=db.ProjectionType.ALL
+            **self._index_projection(tables_config['consoleme_resource_cache'], 'arn-index'),
+            **self._table_capacity(tables_config['consoleme_resource_cache'], 'arn-index')
         )
 
-        db.Table(
+        self._auto_scale_table(cache_table, tables_config['consoleme_resource_cache'])
+
+        cloudtrail_table = db.Table(
             self,
             'CloudTrailTable',
             table_name='consoleme_cloudtrail',
@@ -97,20 +110,118 @@ class DBStack(cdk.NestedStack):
                 name='arn', type=db.AttributeType.STRING),
             sort_key=db.Attribute(
                 name='request_id', type=db.AttributeType.STRING),
-            billing_mode=db.BillingMode.PROVISIONED,
-            read_capacity=10,
-            write_capacity=10,
-            removal_policy=cdk.RemovalPolicy.DESTROY
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute=tables_config['consoleme_cloudtrail'].get('ttl_attribute'),
+            **self._table_capacity(tables_config['consoleme_cloudtrail'])
         )
 
-        db.Table(
+        self._auto_scale_table(cloudtrail_table, tables_config['consoleme_cloudtrail'])
+
+        users_table = db.Table(
             self,
             'UsersTable',
             table_name='consoleme_users_global',
             partition_key=db.Attribute(
                 name='username', type=db.AttributeType.STRING),
-            billing_mode=db.BillingMode.PROVISIONED,
-            read_capacity=5,
-            write_capacity=5,
-            removal_policy=cdk.RemovalPolicy.DESTROY
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            time_to_live_attribute=tables_config['consoleme_users_global'].get('ttl_attribute'),
+            **self._table_capacity(tables_config['consoleme_users_global'])
         )
+
+        self._auto_scale_table(users_table, tables_config['consoleme_users_global'])
+
+        # DAX read-through cache for the hot tables
+
+        dax_endpoint = None
+
+        if config_yaml['dax']['enabled']:
+            dax_subnet_group = dax.CfnSubnetGroup(
+                self,
+                'DAXSubnetGroup',
+                description='Subnet group for DAX Cluster',
+                subnet_ids=[subnet.subnet_id for subnet in vpc.private_subnets]
+            )
+
+            dax_cluster = dax.CfnCluster(
+                self,
+                'DAXCluster',
+                cluster_name=DAX_CLUSTER_NAME,
+                node_type=config_yaml['dax']['node_type'],
+                replication_factor=config_yaml['dax']['replication_factor'],
+                iam_role_arn=dax_service_role.role_arn,
+                subnet_group_name=dax_subnet_group.ref,
+                security_group_ids=[dax_sg.security_group_id],
+                cluster_endpoint_encryption_type='TLS',
+                sse_specification=dax.CfnCluster.SSESpecificationProperty(sse_enabled=True)
+            )
+
+            dax_endpoint = 'daxs://' + dax_cluster.attr_cluster_discovery_endpoint
+
+        self.dax_endpoint = dax_endpoint
+
+    @staticmethod
+    def _table_capacity(table_config: dict, index_name: str = None) -> dict:
+        """
+        Returns the billing mode and initial capacity arguments of a table, or of one of its indexes
+        """
+
+        if table_config['billing_mode'] == 'on_demand':
+            return {} if index_name else {'billing_mode': db.BillingMode.PAY_PER_REQUEST}
+
+        capacity_config = table_config['indexes'][index_name] if index_name else table_config
+        capacity = {
+            'read_capacity': capacity_config['read_capacity']['min'],
+            'write_capacity': capacity_config['write_capacity']['min']
+        }
+
+        return capacity if index_name else dict(capacity, billing_mode=db.BillingMode.PROVISIONED)
+
+    @staticmethod
+    def _index_projection(table_config: dict, index_name: str) -> dict:
+        """
+        Returns the projection arguments of a global secondary index, projecting all attributes by default.
+        DynamoDB only sets the projection when it creates the index, which keeps the name ConsoleMe queries
+        """
+
+        projection_config = table_config.get('indexes', {}).get(index_name, {}).get('projection', {'type': 'all'})
+        projection_type = {
+            'all': db.ProjectionType.ALL,
+            'keys_only': db.ProjectionType.KEYS_ONLY,
+            'include': db.ProjectionType.INCLUDE
+        }[projection_config['type']]
+
+        if projection_type == db.ProjectionType.INCLUDE:
+            return {'projection_type': projection_type, 'non_key_attributes': projection_config['non_key_attributes']}
+
+        return {'projection_type': projection_type}
+
+    def _auto_scale_table(self, table: db.Table, table_config: dict) -> None:
+        """
+        Adds target tracking auto scaling on reads and writes of a provisioned table and its indexes
+        """
+
+        if table_config['billing_mode'] == 'on_demand':
+            return
+
+        table.auto_scale_read_capacity(
+            min_capacity=table_config['read_capacity']['min'],
+            max_capacity=table_config['read_capacity']['max']
+        ).scale_on_utilization(target_utilization_percent=self.target_utilization)
+
+        table.auto_scale_write_capacity(
+            min_capacity=table_config['write_capacity']['min'],
+            max_capacity=table_config['write_capacity']['max']
+        ).scale_on_utilization(target_utilization_percent=self.target_utilization)
+
+        for index_name, index_config in table_config.get('indexes', {}).items():
+            table.auto_scale_global_secondary_index_read_capacity(
+                index_name,
+                min_capacity=index_config['read_capacity']['min'],
+                max_capacity=index_config['read_capacity']['max']
+            ).scale_on_utilization(target_utilization_percent=self.target_utilization)
+
+            table.auto_scale_global_secondary_index_write_capacity(
+                index_name,
+                min_capacity=index_config['write_capacity']['min'],
+                max_capacity=index_config['write_capacity']['max']
+            ).scale_on_utilization(target_utilization_percent=self.target_utilization)
@@ -8,6 +8,9 @@ from aws_cdk import (
     core as cdk
 )
 
+from configuration import load_config
+from constants import CELERY_METRICS_NAMESPACE, DAX_CLUSTER_NAME, DAX_CACHED_TABLES
+
 
 class IAMStack(cdk.NestedStack):
     """
@@ -18,6 +21,8 @@ class IAMStack(cdk.NestedStack):
                  s3_bucket: s3.Bucket, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        config_yaml = load_config()
+
         # Define IAM roles and policies
 
         ecs_task_role = iam.Role(
@@ -209,6 +214,19 @@ class IAMStack(cdk.NestedStack):
             )
         )
 
+        container_registry_config = config_yaml['container_registry']
+
+        # The first pull of an image through the pull-through cache creates its repository and imports the image
+        if container_registry_config['mode'] == 'pull_through_cache':
+            ecs_task_execution_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=['ecr:CreateRepository', 'ecr:BatchImportUpstreamImage'],
+                    resources=['arn:aws:ecr:' + self.region + ':' + self.account + ':repository/'
+                               + container_registry_config['repository_prefix'] + '/*']
+                )
+            )
+
         create_configuration_lambda_role = iam.Role(
             self,
             'CreateConfigurationFileLambdaRole',
@@ -231,6 +249,108 @@ class IAMStack(cdk.NestedStack):
             )
         )
 
+        # Reading back the current configuration files lets unchanged deploys skip rewriting them
+        create_configuration_lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=['s3:GetObject', 's3:ListBucket'],
+                resources=[s3_bucket.bucket_arn, s3_bucket.bucket_arn + '/config.yaml',
+                           s3_bucket.bucket_arn + '/hot_config.yaml']
+            )
+        )
+
+        spoke_accounts_discovery_config = config_yaml['spoke_accounts_discovery']
+
+        if spoke_accounts_discovery_config['source'] == 'organizations':
+            create_configuration_lambda_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=['organizations:ListAccounts'],
+                    resources=['*']
+                )
+            )
+
+        if spoke_accounts_discovery_config['source'] == 's3':
+            create_configuration_lambda_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=['s3:GetObject'],
+                    resources=[s3_bucket.bucket_arn + '/' + spoke_accounts_discovery_config['manifest_key']]
+                )
+            )
+
+        broker_metrics_lambda_role = iam.Role(
+            self,
+            'BrokerMetricsLambdaRole',
+            assumed_by=iam.ServicePrincipal(service='lambda.amazonaws.com')
+        )
+
+        broker_metrics_lambda_role.add_managed_policy(
+            iam.ManagedPolicy.from_managed_policy_arn(
+                self,
+                'BrokerMetricsVPCExecution',
+                managed_policy_arn='arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole'
+            )
+        )
+
+        broker_metrics_lambda_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=['cloudwatch:PutMetricData'],
+                resources=['*'],
+                conditions={'StringEquals': {'cloudwatch:namespace': CELERY_METRICS_NAMESPACE}}
+            )
+        )
+
+        dax_service_role = None
+
+        if config_yaml['dax']['enabled']:
+            ecs_task_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        'dax:BatchGetItem',
+                        'dax:BatchWriteItem',
+                        'dax:ConditionCheckItem',
+                        'dax:DeleteItem',
+                        'dax:GetItem',
+                        'dax:PutItem',
+                        'dax:Query',
+                        'dax:Scan',
+                        'dax:UpdateItem'
+                    ],
+                    resources=['arn:aws:dax:' + self.region + ':' + self.account + ':cache/' + DAX_CLUSTER_NAME]
+                )
+            )
+
+            dax_service_role = iam.Role(
+                self,
+                'DAXServiceRole',
+                assumed_by=iam.ServicePrincipal(service='dax.amazonaws.com')
+            )
+
+            dax_service_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        'dynamodb:BatchGetItem',
+                        'dynamodb:BatchWriteItem',
+                        'dynamodb:ConditionCheckItem',
+                        'dynamodb:DeleteItem',
+                        'dynamodb:DescribeTable',
+                        'dynamodb:GetItem',
+                        'dynamodb:PutItem',
+                        'dynamodb:Query',
+                        'dynamodb:Scan',
+                        'dynamodb:UpdateItem'
+                    ],
+                    resources=['arn:aws:dynamodb:' + self.region + ':' + self.account + ':table/' + table_name
+                               for table_name in DAX_CACHED_TABLES]
+                )
+            )
+
         self.ecs_task_role = ecs_task_role
         self.ecs_task_execution_role = ecs_task_execution_role
         self.create_configuration_lambda_role = create_configuration_lambda_role
+        self.broker_metrics_lambda_role = broker_metrics_lambda_role
+        self.dax_service_role = dax_service_role
@@ -3,10 +3,14 @@ Shared stack for running ConsoleMe on ECS
 """
 
 from aws_cdk import (
+    aws_ecr as ecr,
     aws_s3 as s3,
     core as cdk
 )
 
+from configuration import load_config
+from constants import APPLICATION_PREFIX, CONTAINER_IMAGE, DOCKER_HUB_REGISTRY_URL
+
 
 class SharedStack(cdk.NestedStack):
     """
@@ -16,6 +20,8 @@ class SharedStack(cdk.NestedStack):
     def __init__(self, scope: cdk.Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        container_registry_config = load_config()['container_registry']
+
         s3_bucket = s3.Bucket(
             self,
             'ConfigBucket',
@@ -24,4 +30,49 @@ class SharedStack(cdk.NestedStack):
             encryption=s3.BucketEncryption.S3_MANAGED
         )
 
+        # Container image, pulled from ECR inside the region instead of from Docker Hub over NAT
+
+        repository_name, image_tag = self._split_image(CONTAINER_IMAGE)
+        image_digest = container_registry_config.get('image_digest')
+        image_reference = '@' + image_digest if image_digest else ':' + image_tag
+
+        if container_registry_config['mode'] == 'pull_through_cache':
+            pull_through_cache_rule = ecr.CfnPullThroughCacheRule(
+                self,
+                'PullThroughCacheRule',
+                ecr_repository_prefix=container_registry_config['repository_prefix'],
+                upstream_registry_url=DOCKER_HUB_REGISTRY_URL
+            )
+            # Docker Hub pull-through caches require credentials, which this CDK version has no property for
+            pull_through_cache_rule.add_property_override('UpstreamRegistry', 'docker-hub')
+            pull_through_cache_rule.add_property_override('CredentialArn', container_registry_config['credential_arn'])
+
+            container_image_uri = (self.account + '.dkr.ecr.' + self.region + '.' + self.url_suffix + '/'
+                                   + container_registry_config['repository_prefix'] + '/' + repository_name
+                                   + image_reference)
+        elif container_registry_config['mode'] == 'repository':
+            container_repository = ecr.Repository(
+                self,
+                'ContainerRepository',
+                repository_name=APPLICATION_PREFIX,
+                image_scan_on_push=True
+            )
+
+            container_image_uri = container_repository.repository_uri + image_reference
+        else:
+            container_image_uri = repository_name + image_reference
+
         self.s3_bucket = s3_bucket
+        self.container_image_uri = container_image_uri
+
+    @staticmethod
+    def _split_image(image: str) -> tuple:
+        """
+        Returns the Docker Hub repository name, with the library namespace of official images, and the image tag
+        """
+        repository_name, separator, image_tag = image.rpartition(':')
+        if not separator or '/' in image_tag:
+            repository_name, image_tag = image, ''
+        if '/' not in repository_name:
+            repository_name = 'library/' + repository_name
+        return repository_name, image_tag or 'latest'
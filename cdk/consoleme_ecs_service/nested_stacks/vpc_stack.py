@@ -2,13 +2,14 @@
 VPC stack for running ConsoleMe on ECS
 """
 
-import urllib.request
-
 from aws_cdk import (
     aws_ec2 as ec2,
     core as cdk
 )
 
+from configuration import load_config, resolve_ingress_cidr
+from constants import DAX_PORT
+
 
 class VPCStack(cdk.NestedStack):
     """
@@ -18,6 +19,8 @@ class VPCStack(cdk.NestedStack):
     def __init__(self, scope: cdk.Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        config_yaml = load_config()
+
         # VPC and security groups
 
         vpc = ec2.Vpc(
@@ -35,8 +38,7 @@ class VPCStack(cdk.NestedStack):
 
         # Open ingress to the deploying computer public IP
 
-        my_ip_cidr = urllib.request.urlopen(
-            'http://checkip.amazonaws.com').read().decode('utf-8').strip() + '/32'
+        my_ip_cidr = resolve_ingress_cidr(self)
 
         consoleme_sg.add_ingress_rule(
             peer=ec2.Peer.ipv4(cidr_ip=my_ip_cidr),
@@ -55,6 +57,33 @@ class VPCStack(cdk.NestedStack):
         redis_sg.connections.allow_from(consoleme_sg, port_range=ec2.Port.tcp(
             port=6379), description='Allow ingress from ConsoleMe containers')
 
+        broker_metrics_sg = ec2.SecurityGroup(
+            self,
+            'BrokerMetricsSG',
+            vpc=vpc,
+            description='Consoleme Celery broker metrics lambda security group',
+            allow_all_outbound=True
+        )
+
+        redis_sg.connections.allow_from(broker_metrics_sg, port_range=ec2.Port.tcp(
+            port=6379), description='Allow ingress from Celery broker metrics lambda')
+
+        dax_sg = None
+
+        if config_yaml['dax']['enabled']:
+            dax_sg = ec2.SecurityGroup(
+                self,
+                'DAXSG',
+                vpc=vpc,
+                description='Consoleme DAX security group',
+                allow_all_outbound=True
+            )
+
+            dax_sg.connections.allow_from(consoleme_sg, port_range=ec2.Port.tcp(
+                port=DAX_PORT), description='Allow ingress from ConsoleMe containers')
+
         self.vpc = vpc
         self.redis_sg = redis_sg
         self.consoleme_sg = consoleme_sg
+        self.broker_metrics_sg = broker_metrics_sg
+        self.dax_sg = dax_sg
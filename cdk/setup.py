@@ -29,6 +29,7 @@ setuptools.setup(
         "aws-cdk.aws-iam>=1.107.0",
         "aws-cdk.aws-cognito>=1.107.0",
         "aws-cdk.aws_ec2>=1.107.0",
+        "aws-cdk.aws_ecr>=1.107.0",
         "aws-cdk.aws_ecs>=1.107.0",
         "aws-cdk.aws-ecs-patterns>=1.107.0",
         "aws-cdk.aws_efs>=1.107.0",
@@ -40,10 +41,13 @@ setuptools.setup(
         "aws_cdk.aws_kms>=1.107.0",
         "aws_cdk.aws_elasticache>=1.107.0",
         "aws_cdk.aws_dynamodb>=1.107.0",
+        "aws_cdk.aws_dax>=1.107.0",
         "aws_cdk.custom_resources>=1.107.0",
         "aws_cdk.aws_lambda>=1.107.0",
         "aws_cdk.aws-applicationautoscaling>=1.107.0",
-        "aws-cdk.aws-lambda-python>=1.107.0",
+        "aws_cdk.aws_cloudwatch>=1.107.0",
+        "aws_cdk.aws_events>=1.107.0",
+        "aws_cdk.aws_events_targets>=1.107.0",
         "PyYAML>=5.3.1",
     ],
 
@@ -0,0 +1,9 @@
+"""
+Test configuration, synthesizing the application offline from the example configuration file
+"""
+
+import os
+
+os.environ.setdefault('CONSOLEME_OFFLINE_SYNTH', '1')
+os.environ.setdefault('CONSOLEME_CONFIG_FILE', 'config.yaml.example')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
@@ -0,0 +1,124 @@
+import os
+import socket
+import boto3
+
+# Kombu stores prioritized messages in sibling lists named <queue><separator><priority>
+PRIORITY_SEPARATOR = '\x06\x16'
+PRIORITY_STEPS = [3, 6, 9]
+UNACKED_KEY = 'unacked'
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """
+    Minimal Redis client for the few read commands the metrics need, so the lambda has no dependencies to bundle
+    """
+
+    def __init__(self, host, port=6379, db=0, socket_timeout=5):
+        self.socket = socket.create_connection((host, port), timeout=socket_timeout)
+        self.reader = self.socket.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        encoded_args = [str(arg).encode('utf-8') for arg in args]
+        command = b'*%d\r\n' % len(encoded_args) + b''.join(
+            b'$%d\r\n%s\r\n' % (len(arg), arg) for arg in encoded_args)
+        self.socket.sendall(command)
+        return self.read_reply()
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise RedisError('Connection closed by server')
+        prefix, payload = line[:1], line[1:].rstrip(b'\r\n')
+        if prefix == b'-':
+            raise RedisError(payload.decode('utf-8'))
+        if prefix == b':':
+            return int(payload)
+        if prefix == b'+':
+            return payload.decode('utf-8')
+        if prefix == b'$':
+            length = int(payload)
+            return None if length < 0 else self.reader.read(length + 2)[:-2]
+        if prefix == b'*':
+            length = int(payload)
+            return None if length < 0 else [self.read_reply() for _ in range(length)]
+        raise RedisError('Unexpected reply: %r' % line)
+
+    def llen(self, key):
+        return self.execute('LLEN', key)
+
+    def hlen(self, key):
+        return self.execute('HLEN', key)
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+def get_queue_lengths(redis_client, queue_names):
+    queue_lengths = {}
+
+    for queue_name in queue_names:
+        queue_keys = [queue_name] + [queue_name + PRIORITY_SEPARATOR + str(priority)
+                                     for priority in PRIORITY_STEPS]
+        queue_lengths[queue_name] = sum(redis_client.llen(queue_key) for queue_key in queue_keys)
+
+    return queue_lengths
+
+
+def get_unacked_count(redis_client):
+    return redis_client.hlen(UNACKED_KEY)
+
+
+def build_metric_data(queue_lengths, unacked_count):
+    metric_data = [
+        {
+            'MetricName': 'QueueLength',
+            'Dimensions': [{'Name': 'Queue', 'Value': queue_name}],
+            'Value': queue_length,
+            'Unit': 'Count'
+        }
+        for queue_name, queue_length in queue_lengths.items()
+    ]
+
+    metric_data.append({
+        'MetricName': 'UnackedMessages',
+        'Value': unacked_count,
+        'Unit': 'Count'
+    })
+
+    metric_data.append({
+        'MetricName': os.getenv('BACKLOG_METRIC_NAME', 'BrokerBacklog'),
+        'Value': sum(queue_lengths.values()),
+        'Unit': 'Count'
+    })
+
+    return metric_data
+
+
+def handler(event, context):
+    redis_client = RedisConnection(
+        host=os.getenv('REDIS_HOST'),
+        port=int(os.getenv('REDIS_PORT', '6379')),
+        db=int(os.getenv('REDIS_DB', '2')),
+        socket_timeout=5
+    )
+    cloudwatch_client = boto3.client('cloudwatch')
+
+    queue_names = os.getenv('CELERY_QUEUES', 'celery').split(',')
+    try:
+        queue_lengths = get_queue_lengths(redis_client, queue_names)
+        unacked_count = get_unacked_count(redis_client)
+    finally:
+        redis_client.close()
+
+    metric_data = build_metric_data(queue_lengths, unacked_count)
+    cloudwatch_client.put_metric_data(
+        Namespace=os.getenv('METRICS_NAMESPACE'), MetricData=metric_data)
+
+    return {'QueueLengths': queue_lengths, 'UnackedMessages': unacked_count}
@@ -1,19 +1,32 @@
 import boto3
+import csv
+import dictdiffer
+import hashlib
+import json
 import os
-import cfnresponse
-import yaml
+import re
+import tempfile
+from botocore.exceptions import ClientError
 
-spoke_accounts_objects_dict = {}
-spoke_accounts_objects_dict[os.getenv('ACCOUNT_NUMBER')] = [
-    'account_' + os.getenv('ACCOUNT_NUMBER')]
-spoke_accounts_list = os.getenv('SPOKE_ACCOUNTS').split(',')
+# Rendered configuration files larger than this are spooled to disk instead of memory
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
 
-for account_id in spoke_accounts_list:
-    spoke_accounts_objects_dict[str(account_id)] = ['account_' + account_id]
+# Changed keys reported back per list, which must fit in the 4096 bytes of custom resource response data
+MAX_REPORTED_CHANGED_KEYS = 25
 
-spoke_accounts_objects_list_yaml = yaml.dump(
-    {'account_ids_to_name': spoke_accounts_objects_dict}, explicit_start=False, default_flow_style=False,
-    default_style="'")
+# Configuration keys ConsoleMe only reads on startup, any other key is reloaded by the running tasks
+RESTART_REQUIRED_KEYS = [
+    'url', 'tornado', 'auth', 'oidc_secrets', 'jwt_secret', 'get_user_by_oidc_settings',
+    'redis', 'celery', 'aws', 'dax', 'config', 'extends'
+]
+
+# The tasks read the restart required keys from their local copy of the configuration file,
+# which extends the hot reloaded keys in S3
+CONFIG_KEY = 'config.yaml'
+HOT_CONFIG_KEY = 'hot_config.yaml'
+
+# Values only known at deploy time are rendered at synth time as ${NAME} placeholders of environment variables
+PLACEHOLDER = re.compile(r'\$\{([A-Z_]+)\}')
 
 s3_client = boto3.client('s3')
 
@@ -27,48 +40,196 @@ def handler(event, context):
         return on_create(event, context)
     if request_type == 'Delete':
         return on_delete(event, context)
+    if request_type == 'Refresh':
+        return on_refresh(event, context)
 
     raise Exception("Invalid request type: %s" % request_type)
 
 
+def iter_spoke_accounts():
+    source = os.getenv('SPOKE_ACCOUNTS_SOURCE', 'config')
+
+    if source == 'organizations':
+        paginator = boto3.client('organizations').get_paginator('list_accounts')
+        for page in paginator.paginate():
+            for account in page['Accounts']:
+                if account['Status'] == 'ACTIVE':
+                    yield account['Id'], account['Name']
+    elif source == 's3':
+        # CSV manifest with an account id and an optional account name on each line
+        manifest = s3_client.get_object(
+            Bucket=os.getenv('DEPLOYMENT_BUCKET'), Key=os.getenv('SPOKE_ACCOUNTS_MANIFEST_KEY'))
+        lines = (line.decode('utf-8') for line in manifest['Body'].iter_lines())
+        for row in csv.reader(lines):
+            if not row or row[0].strip().startswith('#'):
+                continue
+            account_id = row[0].strip()
+            yield account_id, row[1].strip() if len(row) > 1 and row[1].strip() else 'account_' + account_id
+
+
+def discover_account_ids_to_name():
+    account_ids_to_name = {}
+    for account_id, account_name in iter_spoke_accounts():
+        account_ids_to_name.setdefault(account_id, [account_name])
+
+    main_account_id = os.getenv('ACCOUNT_NUMBER')
+    account_ids_to_name.setdefault(main_account_id, ['account_' + main_account_id])
+
+    return account_ids_to_name
+
+
+def fill_placeholders(value):
+    if isinstance(value, dict):
+        return {fill_placeholders(key): fill_placeholders(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_placeholders(item) for item in value]
+    if isinstance(value, str):
+        return PLACEHOLDER.sub(lambda match: os.environ[match.group(1)], value)
+    return value
+
+
+def render_config(event):
+    config = fill_placeholders(json.loads(event['ResourceProperties']['Config']))
+
+    # Accounts from config.yaml are rendered at synth time, discovered accounts are only known now
+    if os.getenv('SPOKE_ACCOUNTS_SOURCE', 'config') != 'config':
+        config['account_ids_to_name'] = discover_account_ids_to_name()
+
+    return config
+
+
+def file_etag(config_file):
+    # Single part uploads to an S3 managed key bucket have the content MD5 as ETag
+    md5 = hashlib.md5()
+    config_file.seek(0)
+    for chunk in iter(lambda: config_file.read(1024 * 1024), b''):
+        md5.update(chunk)
+    config_file.seek(0)
+    return '"' + md5.hexdigest() + '"'
+
+
+def current_etag(bucket_name, s3_path):
+    try:
+        return s3_client.head_object(Bucket=bucket_name, Key=s3_path)['ETag']
+    except ClientError:
+        return None
+
+
+def current_config(bucket_name, s3_path):
+    try:
+        return json.load(s3_client.get_object(Bucket=bucket_name, Key=s3_path)['Body'])
+    except (ClientError, ValueError):
+        # Missing, or rendered as YAML by an earlier version, so every key counts as changed
+        return {}
+
+
+def changed_keys(old_config, new_config):
+    keys = set()
+    for change, path, values in dictdiffer.diff(old_config, new_config, dot_notation=False):
+        path = [str(key) for key in path]
+        if change == 'change':
+            keys.add('.'.join(path))
+        else:
+            # Additions and removals carry the added or removed keys in their values
+            keys.update('.'.join(path + [str(key)]) for key, value in values)
+    return sorted(keys)
+
+
+def split_config(config, bucket_name):
+    restart_config = {key: value for key, value in config.items() if key in RESTART_REQUIRED_KEYS}
+    hot_config = {key: value for key, value in config.items() if key not in RESTART_REQUIRED_KEYS}
+
+    # ConsoleMe merges the extended S3 object into its configuration, and reloads it periodically
+    restart_config['extends'] = ['AWS_S3:s3://%s/%s' % (bucket_name, HOT_CONFIG_KEY)]
+    restart_config['config'] = dict(config.get('config', {}), automatically_reload_configuration=True)
+
+    return restart_config, hot_config
+
+
+def restart_token(restart_config):
+    return hashlib.sha256(json.dumps(restart_config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def reported_keys(keys):
+    reported = keys[:MAX_REPORTED_CHANGED_KEYS]
+    if len(keys) > MAX_REPORTED_CHANGED_KEYS:
+        reported.append('(%d more)' % (len(keys) - MAX_REPORTED_CHANGED_KEYS))
+    return ','.join(reported)
+
+
+def write_object(bucket_name, s3_path, content):
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as config_file:
+        # JSON is valid YAML, and needs no dependencies to write
+        for chunk in json.JSONEncoder(indent=2).iterencode(content):
+            config_file.write(chunk.encode('utf-8'))
+        etag = file_etag(config_file)
+
+        changed = etag != current_etag(bucket_name, s3_path)
+        if changed:
+            etag = s3_client.put_object(Bucket=bucket_name, Key=s3_path, Body=config_file)['ETag']
+
+    return etag, changed
+
+
+def write_config(bucket_name, config):
+    restart_config, hot_config = split_config(config, bucket_name)
+
+    # Files written before the split hold every key in the configuration file
+    old_config = dict(current_config(bucket_name, CONFIG_KEY), **current_config(bucket_name, HOT_CONFIG_KEY))
+    keys = changed_keys(old_config, dict(restart_config, **hot_config))
+    restart_required_keys = [key for key in keys if key.split('.')[0] in RESTART_REQUIRED_KEYS]
+    hot_reloaded_keys = [key for key in keys if key.split('.')[0] not in RESTART_REQUIRED_KEYS]
+    print('Configuration changes, restart required: %s, hot reloaded: %s' % (restart_required_keys, hot_reloaded_keys))
+
+    etag, restart_changed = write_object(bucket_name, CONFIG_KEY, restart_config)
+    hot_config_etag, hot_changed = write_object(bucket_name, HOT_CONFIG_KEY, hot_config)
+
+    # The restart token only changes with the restart required keys, and rolls the ECS services when it does
+    return {
+        'ETag': etag,
+        'HotConfigETag': hot_config_etag,
+        'Changed': 'true' if restart_changed or hot_changed else 'false',
+        'RestartRequiredKeys': reported_keys(restart_required_keys),
+        'HotReloadedKeys': reported_keys(hot_reloaded_keys),
+        'RestartToken': restart_token(restart_config)
+    }
+
+
 def on_create(event, context):
-    with open('config.yaml') as f:
-        config_yaml = f.read()
-
-    config_yaml = config_yaml.format(
-        issuer=os.getenv('ISSUER'),
-        jwt_secret=os.getenv('JWT_SECRET'),
-        oidc_client_id=os.getenv('OIDC_CLIENT_ID'),
-        oidc_client_secret=os.getenv('OIDC_CLIENT_SECRET'),
-        oidc_metadata_url=os.getenv('OIDC_METADATA_URL'),
-        redis_host=os.getenv('REDIS_HOST'),
-        aws_region=os.getenv('AWS_REGION'),
-        ses_identity_arn=os.getenv('SES_IDENTITY_ARN'),
-        support_chat_url=os.getenv('SUPPORT_CHAT_URL'),
-        application_admin=os.getenv('APPLICATION_ADMIN'),
-        account_number=os.getenv('ACCOUNT_NUMBER'),
-        spoke_accounts_objects_list_yaml=spoke_accounts_objects_list_yaml
-    )
-    encoded_config = config_yaml.encode("utf-8")
+    bucket_name = os.getenv('DEPLOYMENT_BUCKET')
+
+    return {'Data': write_config(bucket_name, render_config(event))}
 
+
+def on_refresh(event, context):
+    # Scheduled between deploys, as the custom resource only runs when its synth time inputs change
     bucket_name = os.getenv('DEPLOYMENT_BUCKET')
-    file_name = "config.yaml"
-    s3_path = file_name
 
-    try:
-        result = s3_client.put_object(Bucket=bucket_name, Key=s3_path, Body=encoded_config)
-        cfnresponse.send(event, context, cfnresponse.SUCCESS, result)
-    except Exception as e:
-        cfnresponse.send(event, context, cfnresponse.FAILED, result)
+    hot_config = current_config(bucket_name, HOT_CONFIG_KEY)
+    if not hot_config:
+        # Nothing to refresh before the first deploy wrote the configuration
+        return {'Data': {'Changed': 'false'}}
+
+    # The running tasks reload the accounts from the hot reloaded configuration, without a new deployment
+    old_accounts = hot_config.get('account_ids_to_name', {})
+    hot_config['account_ids_to_name'] = discover_account_ids_to_name()
+    keys = changed_keys({'account_ids_to_name': old_accounts},
+                        {'account_ids_to_name': hot_config['account_ids_to_name']})
+    print('Configuration changes, hot reloaded: %s' % keys)
+
+    hot_config_etag, changed = write_object(bucket_name, HOT_CONFIG_KEY, hot_config)
+
+    return {
+        'Data': {
+            'HotConfigETag': hot_config_etag,
+            'Changed': 'true' if changed else 'false',
+            'HotReloadedKeys': reported_keys(keys)
+        }
+    }
 
 
 def on_delete(event, context):
     bucket_name = os.getenv('DEPLOYMENT_BUCKET')
-    file_name = "config.yaml"
-    s3_path = file_name
 
-    try:
-        result = s3_client.delete_object(Bucket=bucket_name, Key=s3_path)
-        cfnresponse.send(event, context, cfnresponse.SUCCESS, result)
-    except Exception as e:
-        cfnresponse.send(event, context, cfnresponse.FAILED, result)
+    for s3_path in (CONFIG_KEY, HOT_CONFIG_KEY):
+        s3_client.delete_object(Bucket=bucket_name, Key=s3_path)
@@ -0,0 +1,57 @@
+import boto3
+
+INIT_CONTAINER_NAME = 'RedisInitContainer'
+
+ecs_client = boto3.client('ecs')
+
+
+def on_event(event, context):
+    request_type = event['RequestType']
+
+    if request_type in ('Create', 'Update'):
+        return run_task(event)
+    if request_type == 'Delete':
+        return {}
+
+    raise Exception("Invalid request type: %s" % request_type)
+
+
+def run_task(event):
+    properties = event['ResourceProperties']
+
+    response = ecs_client.run_task(
+        cluster=properties['Cluster'],
+        taskDefinition=properties['TaskDefinition'],
+        launchType='FARGATE',
+        count=1,
+        startedBy='consoleme-redis-init',
+        networkConfiguration={
+            'awsvpcConfiguration': {
+                'subnets': properties['Subnets'],
+                'securityGroups': properties['SecurityGroups'],
+                'assignPublicIp': 'DISABLED'
+            }
+        }
+    )
+
+    if response['failures'] or not response['tasks']:
+        raise Exception("Failed running the Redis initialization task: %s" % response['failures'])
+
+    return {'Data': {'TaskArn': response['tasks'][0]['taskArn']}}
+
+
+def is_complete(event, context):
+    if event['RequestType'] == 'Delete':
+        return {'IsComplete': True}
+
+    task = ecs_client.describe_tasks(
+        cluster=event['ResourceProperties']['Cluster'], tasks=[event['Data']['TaskArn']])['tasks'][0]
+
+    if task['lastStatus'] != 'STOPPED':
+        return {'IsComplete': False}
+
+    containers = [container for container in task['containers'] if container['name'] == INIT_CONTAINER_NAME]
+    if not containers or containers[0].get('exitCode') != 0:
+        raise Exception("Redis initialization task failed: %s" % task.get('stoppedReason'))
+
+    return {'IsComplete': True}
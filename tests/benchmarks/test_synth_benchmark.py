@@ -0,0 +1,127 @@
+"""
+Synth benchmarks for ConsoleMe on ECS, scaling with the amount of spoke accounts
+
+Run with `pytest -m benchmark`, and set CONSOLEME_BENCHMARK_UPDATE_BASELINE=1 to store the results as the new baseline.
+The resource counts, template sizes, wall time and peak RSS of each run are compared with the baseline.
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+import yaml
+
+pytestmark = pytest.mark.benchmark
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Large account fleets roll out their trust roles with a StackSet, small ones with a stack per account
+BENCHMARK_CASES = [('stackset', 1), ('stackset', 10), ('stackset', 100), ('stackset', 500),
+                   ('stacks', 1), ('stacks', 20)]
+
+TEMPLATE_BYTES_TOLERANCE = 1.1
+# Wall time and peak RSS vary with the host and its load, so they get a wider margin
+RUNTIME_TOLERANCE = 1.5
+
+
+def load_baseline() -> dict:
+    """
+    Returns the stored benchmark baseline, keyed by the deployment mode and the amount of spoke accounts
+    """
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE) as baseline_file:
+        return json.load(baseline_file)
+
+
+def synth_with_spoke_accounts(deployment_mode: str, spoke_account_count: int, work_dir: str) -> dict:
+    """
+    Synthesizes the application in a separate process with a generated configuration file,
+    and returns its wall time, peak RSS, and the resource counts and sizes of its templates
+    """
+    with open('config.yaml.example') as config_file:
+        config_yaml = yaml.load(config_file, Loader=yaml.FullLoader)
+    config_yaml['spoke_accounts'] = [str(100000000000 + index) for index in range(spoke_account_count)]
+    config_yaml['spoke_accounts_deployment']['mode'] = deployment_mode
+
+    config_path = os.path.join(work_dir, 'config.yaml')
+    with open(config_path, 'w') as config_file:
+        yaml.dump(config_yaml, config_file)
+
+    out_dir = os.path.join(work_dir, 'cdk.out')
+    env = dict(os.environ, CONSOLEME_OFFLINE_SYNTH='1', CONSOLEME_CONFIG_FILE=config_path, CDK_OUTDIR=out_dir,
+               JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION='1')
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', 'import app'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall_seconds = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    assert process.returncode == 0, f'Synth with {spoke_account_count} spoke accounts failed'
+
+    template_bytes = {}
+    resource_counts = {}
+    for template_path in glob.glob(os.path.join(out_dir, '*.template.json')):
+        template_name = os.path.basename(template_path).split('.')[0]
+        template_bytes[template_name] = os.path.getsize(template_path)
+        with open(template_path) as template_file:
+            resource_counts[template_name] = len(json.load(template_file).get('Resources', {}))
+
+    return {
+        'wall_seconds': round(wall_seconds, 2),
+        # ru_maxrss is in kilobytes on Linux, and covers the largest of the python and jsii node processes
+        'peak_rss_mb': round(rusage.ru_maxrss / 1024, 1),
+        'template_bytes': template_bytes,
+        'resource_counts': resource_counts
+    }
+
+
+@pytest.fixture(scope='module')
+def results():
+    """
+    Collects the benchmark results of all the runs, and stores them as the baseline when requested
+    """
+    collected = {}
+    yield collected
+    if os.getenv('CONSOLEME_BENCHMARK_UPDATE_BASELINE') and collected:
+        baseline = load_baseline()
+        baseline.update(collected)
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+
+
+@pytest.mark.parametrize('deployment_mode, spoke_account_count', BENCHMARK_CASES)
+def test_synth_benchmark(deployment_mode, spoke_account_count, tmp_path, results, capsys):
+    """
+    Test if the resource counts, template sizes, wall time and peak RSS stay within the stored baseline
+    """
+    case = f'{deployment_mode}-{spoke_account_count}'
+    result = synth_with_spoke_accounts(deployment_mode, spoke_account_count, str(tmp_path))
+    results[case] = result
+
+    baseline = load_baseline().get(case)
+    with capsys.disabled():
+        print(f"\n{spoke_account_count} spoke accounts in {deployment_mode} mode: "
+              f"{result['wall_seconds']}s wall, {result['peak_rss_mb']}MB peak RSS"
+              + (f" ({result['wall_seconds'] / baseline['wall_seconds']:.2f}x and "
+                 f"{result['peak_rss_mb'] / baseline['peak_rss_mb']:.2f}x the baseline)" if baseline else ''))
+        for template_name, size in sorted(result['template_bytes'].items()):
+            print(f"  {template_name}: {result['resource_counts'][template_name]} resources, {size} bytes")
+
+    if not baseline or os.getenv('CONSOLEME_BENCHMARK_UPDATE_BASELINE'):
+        pytest.skip(f'No baseline to compare with for {spoke_account_count} spoke accounts in {deployment_mode} mode')
+
+    for template_name, resource_count in result['resource_counts'].items():
+        assert resource_count <= baseline['resource_counts'].get(template_name, 0), \
+            f'{template_name} template has more resources than the baseline'
+    for template_name, size in result['template_bytes'].items():
+        assert size <= baseline['template_bytes'].get(template_name, 0) * TEMPLATE_BYTES_TOLERANCE, \
+            f'{template_name} template grew past the baseline'
+    assert result['wall_seconds'] <= baseline['wall_seconds'] * RUNTIME_TOLERANCE, 'Synth got slower than the baseline'
+    assert result['peak_rss_mb'] <= baseline['peak_rss_mb'] * RUNTIME_TOLERANCE, \
+        'Synth peak RSS grew past the baseline'
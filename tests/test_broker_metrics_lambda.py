@@ -0,0 +1,99 @@
+"""
+Tests for the Celery broker metrics lambda, running against a fake Redis
+"""
+
+import importlib.util
+import threading
+
+import fakeredis
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    'broker_metrics_lambda', 'resources/broker_metrics_lambda/index.py')
+broker_metrics_lambda = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(broker_metrics_lambda)
+
+
+@pytest.fixture
+def redis_client():
+    """
+    Returns a fake Redis client with queued and unacked Celery messages
+    """
+    client = fakeredis.FakeRedis()
+    client.rpush('celery', 'task-1', 'task-2', 'task-3')
+    client.rpush('celery' + broker_metrics_lambda.PRIORITY_SEPARATOR + '6', 'task-4')
+    client.rpush('cache_refresh', 'task-5')
+    client.hset('unacked', 'delivery-tag-1', 'task-6')
+    client.hset('unacked', 'delivery-tag-2', 'task-7')
+    return client
+
+
+@pytest.fixture
+def redis_server():
+    """
+    Returns the address of a fake Redis server listening on a local port
+    """
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def test_redis_connection_replies(redis_server):
+    """
+    Test if the dependency-free Redis client encodes commands and parses every reply type of the Redis protocol
+    """
+    host, port = redis_server
+    redis_connection = broker_metrics_lambda.RedisConnection(host, port, db=1)
+    try:
+        assert redis_connection.execute('RPUSH', 'celery' + broker_metrics_lambda.PRIORITY_SEPARATOR + '3', 'a', 'b') == 2
+        assert redis_connection.execute('HSET', 'unacked', 'tag', 'task') == 1
+        assert redis_connection.llen('celery' + broker_metrics_lambda.PRIORITY_SEPARATOR + '3') == 2
+        assert redis_connection.hlen('unacked') == 1
+        assert redis_connection.execute('PING') == 'PONG'
+        assert redis_connection.execute('GET', 'missing') is None
+        assert redis_connection.execute('LRANGE', 'celery' + broker_metrics_lambda.PRIORITY_SEPARATOR + '3', 0, -1) == [b'a', b'b']
+        with pytest.raises(broker_metrics_lambda.RedisError):
+            redis_connection.execute('LLEN', 'unacked')
+    finally:
+        redis_connection.close()
+
+
+def test_queue_lengths_include_priority_queues(redis_client):
+    """
+    Test if the queue length sums the queue list with its priority siblings
+    """
+    assert broker_metrics_lambda.get_queue_lengths(
+        redis_client, ['celery', 'cache_refresh', 'empty']) == {'celery': 4, 'cache_refresh': 1, 'empty': 0}
+
+
+def test_unacked_count(redis_client):
+    """
+    Test if the unacked messages are counted from the Celery unacked hash
+    """
+    assert broker_metrics_lambda.get_unacked_count(redis_client) == 2
+
+
+def test_handler_publishes_metrics(redis_client, mocker, monkeypatch):
+    """
+    Test if the handler publishes per-queue, unacked and backlog metrics to CloudWatch
+    """
+    monkeypatch.setenv('CELERY_QUEUES', 'celery,cache_refresh')
+    monkeypatch.setenv('METRICS_NAMESPACE', 'ConsoleMe/Celery')
+    mocker.patch.object(broker_metrics_lambda, 'RedisConnection', return_value=redis_client)
+    cloudwatch_client = mocker.Mock()
+    mocker.patch.object(broker_metrics_lambda.boto3, 'client', return_value=cloudwatch_client)
+
+    broker_metrics_lambda.handler({}, None)
+
+    metric_data = cloudwatch_client.put_metric_data.call_args.kwargs['MetricData']
+    metrics = {(metric['MetricName'], tuple(d['Value'] for d in metric.get('Dimensions', []))): metric['Value']
+               for metric in metric_data}
+    assert cloudwatch_client.put_metric_data.call_args.kwargs['Namespace'] == 'ConsoleMe/Celery'
+    assert metrics == {
+        ('QueueLength', ('celery',)): 4,
+        ('QueueLength', ('cache_refresh',)): 1,
+        ('UnackedMessages', ()): 2,
+        ('BrokerBacklog', ()): 5
+    }
@@ -0,0 +1,131 @@
+"""
+Tests for loading the configuration file and resolving the deployment environment
+"""
+
+import pytest
+import yaml
+
+from aws_cdk import core as cdk
+
+import configuration
+
+DEFAULT_POOL = {'queues': ['celery'], 'min_capacity': 1, 'max_capacity': 2}
+
+
+@pytest.fixture
+def example_config():
+    """
+    Returns the example configuration file contents
+    """
+    with open('config.yaml.example') as config_file:
+        return yaml.load(config_file, Loader=yaml.FullLoader)
+
+
+def test_load_config_is_cached():
+    """
+    Test if the configuration file is parsed once and shared by all callers
+    """
+    assert configuration.load_config() is configuration.load_config()
+
+
+@pytest.mark.parametrize('override, message', [
+    ({'jwt_secret': None}, 'jwt_secret'),
+    ({'spoke_accounts': [123456789123]}, 'Spoke account'),
+    ({'spoke_accounts': [str(123456789100 + index) for index in range(21)]}, 'stackset for more than 20 spoke accounts'),
+    ({'spoke_accounts_deployment': {'mode': 'stackset', 'call_as': 'ADMIN'}}, 'call_as'),
+    ({'spoke_accounts_deployment': {'mode': 'stackset', 'call_as': 'DELEGATED_ADMIN', 'organizational_unit_ids': []}},
+     'organizational_unit_ids'),
+    ({'spoke_accounts_discovery': {'source': 'organizations'}}, 'refresh_schedule'),
+    ({'min_capacity': 20}, 'min_capacity'),
+    ({'web_processes': 6}, 'web_processes'),
+    ({'container_registry': {'mode': 'pull_through_cache', 'repository_prefix': 'docker-hub'}}, 'credential_arn'),
+    ({'container_registry': {'mode': 'repository', 'image_digest': 'latest'}}, 'image_digest'),
+    ({'web_autoscaling': {'scheduled': [{'name': 'Peak', 'min_capacity': 5, 'max_capacity': 4}]}}, 'Peak'),
+    ({'capacity_providers': {'web': [{'capacity_provider': 'EC2'}], 'celery_worker': []}}, 'capacity_providers web'),
+    ({'capacity_providers': {'web': [{'capacity_provider': 'FARGATE', 'base': 1},
+                                     {'capacity_provider': 'FARGATE_SPOT', 'base': 1}]}}, 'base'),
+    ({'celery_worker': {'pool': 'eventlet', 'pools': {'default': DEFAULT_POOL}}}, 'prefork, gevent or threads'),
+    ({'celery_worker': {'pool': 'threads', 'log_level': 'INFO', 'autoscale': {'min': 1, 'max': 4},
+                        'pools': {'default': DEFAULT_POOL}}}, 'autoscale'),
+    ({'celery_worker': {'pool': 'prefork', 'log_level': 'INFO', 'concurrency': 4,
+                        'pools': {'cache': dict(DEFAULT_POOL, queues=['cache'])}}}, 'celery queue'),
+    ({'celery_worker': {'pool': 'prefork', 'log_level': 'INFO', 'concurrency': 4,
+                        'pools': {'default': DEFAULT_POOL, 'cache': DEFAULT_POOL}}}, 'both default and cache'),
+    ({'task_sizes': {'web': {'cpu': 1024, 'memory_limit_mib': 1024}}}, 'task_sizes web'),
+    ({'load_balancing': {'health_check': {'path': '/healthcheck', 'timeout_seconds': 15, 'interval_seconds': 15},
+                         'deregistration_delay_seconds': 30}}, 'timeout_seconds'),
+    ({'load_balancing': {'health_check': {'path': '/healthcheck', 'timeout_seconds': 5, 'interval_seconds': 15},
+                         'deregistration_delay_seconds': 30, 'slow_start_seconds': 60,
+                         'least_outstanding_requests': True}}, 'least_outstanding_requests'),
+    ({'dynamodb_tables': {'consoleme_resource_cache': {'billing_mode': 'on_demand', 'indexes': {'arn-index': {
+        'projection': {'type': 'include', 'non_key_attributes': ['accountId'], 'index_name': 'arn-account-index'}}}}}},
+     "can't rename"),
+    ({'dynamodb_tables': {'consoleme_config_global': {'billing_mode': 'provisioned',
+                                                      'read_capacity': {'min': 10, 'max': 100}}}}, 'write_capacity'),
+    ({'dynamodb_tables': {'consoleme_config_global': {'billing_mode': 'provisioned',
+                                                      'read_capacity': {'min': 10, 'max': 100},
+                                                      'write_capacity': {'min': 100, 'max': 10}}}}, 'not more than max'),
+    ({'dynamodb_tables': {'consoleme_resource_cache': {'billing_mode': 'provisioned',
+                                                       'read_capacity': {'min': 10, 'max': 100},
+                                                       'write_capacity': {'min': 10, 'max': 100}}}}, 'arn-index'),
+    ({'dynamodb_tables': {'consoleme_resource_cache': {'billing_mode': 'provisioned',
+                                                       'read_capacity': {'min': 10, 'max': 100},
+                                                       'write_capacity': {'min': 10, 'max': 100},
+                                                       'indexes': {'arn-index': {'read_capacity': {'min': 10}}}}}},
+     'Index arn-index read_capacity'),
+    ({'dynamodb_tables': {'consoleme_config_global': {'billing_mode': 'on_demand', 'indexes': {'arn-index': {}}}}},
+     'has no index'),
+    ({'redis': {'node_type': 'cache.t3.micro', 'replicas_per_shard': 1, 'cluster_mode': True}}, 'cluster_mode'),
+    ({'celery_broker_redis': {'node_type': 'cache.t3.micro', 'replicas_per_shard': 0, 'automatic_failover': True}},
+     'celery_broker_redis automatic_failover'),
+    ({'path_routing': {'api': {'paths': ['/api/*'] * 6, 'min_capacity': 1, 'max_capacity': 2}}}, 'path_routing api'),
+    ({'path_routing': {'api': {'paths': ['/api/*'], 'min_capacity': 1, 'max_capacity': 2, 'web_processes': 6}}},
+     'path_routing api web_processes'),
+    ({'task_sizes': {'web': {'cpu': 1024, 'memory_limit_mib': 2048, 'container_cpu': 2048,
+                             'container_memory_reservation_mib': 1024}}}, 'reservations'),
+])
+def test_validate_config_rejects_invalid_values(example_config, override, message):
+    """
+    Test if invalid configuration values are rejected with a message naming the key
+    """
+    example_config.update(override)
+    with pytest.raises(ValueError, match=message):
+        configuration.validate_config(example_config)
+
+
+def test_validate_config_rejects_missing_keys(example_config):
+    """
+    Test if missing configuration keys are reported
+    """
+    del example_config['hosted_zone_id']
+    with pytest.raises(ValueError, match='hosted_zone_id'):
+        configuration.validate_config(example_config)
+
+
+def test_offline_resolution_uses_context_and_placeholders(monkeypatch):
+    """
+    Test if the account and ingress CIDR resolve from context, and fall back to placeholders offline without network access
+    """
+    monkeypatch.setenv(configuration.OFFLINE_ENV, '1')
+    monkeypatch.delenv('CDK_DEFAULT_ACCOUNT', raising=False)
+    monkeypatch.delenv('CONSOLEME_INGRESS_CIDR', raising=False)
+
+    app = cdk.App(context={'main_account_id': '111111111111', 'ingress_cidr': '10.0.0.0/8'})
+    assert configuration.resolve_account_id(app) == '111111111111'
+    assert configuration.resolve_ingress_cidr(app) == '10.0.0.0/8'
+
+    app = cdk.App()
+    assert configuration.resolve_account_id(app) == configuration.OFFLINE_ACCOUNT_ID
+    assert configuration.resolve_ingress_cidr(app) == configuration.OFFLINE_INGRESS_CIDR
+
+
+def test_celery_worker_pools_inherit_shared_settings(example_config):
+    """
+    Test if each Celery worker pool inherits the shared celery_worker settings it does not override
+    """
+    pools = configuration.celery_worker_pools(example_config)
+
+    assert pools['default']['concurrency'] == example_config['celery_worker']['concurrency']
+    assert pools['cache']['concurrency'] == example_config['celery_worker']['pools']['cache']['concurrency']
+    assert all(worker_config['pool'] == example_config['celery_worker']['pool'] for worker_config in pools.values())
+    assert all('pools' not in worker_config for worker_config in pools.values())
@@ -2,18 +2,93 @@
 Tests for ConsoleMe on ECS main CloudFormation stack
 """
 
+import glob
+import json
+import os
+import runpy
+
 import pytest
+import yaml
 
 from cdk.consoleme_ecs_service.constants import BASE_NAME
+from consoleme_spoke_accounts_stack import ConsolemeSpokeAccountsStack
+from configuration import load_config, celery_worker_pools
 from app import app
 
 
 @pytest.fixture(scope="module")
-def cf_template():
+def config_yaml():
+    """
+    Returns the configuration file the application is synthesized with
+    """
+    return load_config()
+
+
+@pytest.fixture(scope="module")
+def cloud_assembly():
+    """
+    Returns synthesized cloud assembly of the whole application
+    """
+    return app.synth()
+
+
+@pytest.fixture(scope="module")
+def cf_template(cloud_assembly):
     """
     Returns synthesized template from main stack
     """
-    return app.synth().get_stack(BASE_NAME).template
+    return cloud_assembly.get_stack(BASE_NAME).template
+
+
+@pytest.fixture(scope="module")
+def all_templates(cloud_assembly):
+    """
+    Returns synthesized templates of all the stacks and nested stacks in the application
+    """
+    return assembly_templates(cloud_assembly)
+
+
+@pytest.fixture
+def synth_with_config(tmp_path_factory, monkeypatch):
+    """
+    Returns a function synthesizing the whole application again, from the example configuration file with
+    the given top level keys replaced
+    """
+    def synth(**overrides):
+        with open('config.yaml.example') as config_file:
+            config = yaml.load(config_file, Loader=yaml.FullLoader)
+        config.update(overrides)
+
+        work_dir = tmp_path_factory.mktemp('synth')
+        with open(work_dir / 'config.yaml', 'w') as config_file:
+            yaml.dump(config, config_file)
+
+        monkeypatch.setenv('CONSOLEME_CONFIG_FILE', str(work_dir / 'config.yaml'))
+        monkeypatch.setenv('CDK_OUTDIR', str(work_dir / 'cdk.out'))
+        load_config.cache_clear()
+        return runpy.run_path('app.py')['app'].synth()
+
+    yield synth
+    load_config.cache_clear()
+
+
+def assembly_templates(cloud_assembly):
+    """
+    Returns the templates of all the stacks and nested stacks in a cloud assembly
+    """
+    templates = []
+    for template_path in glob.glob(os.path.join(cloud_assembly.directory, '*.template.json')):
+        with open(template_path) as template_file:
+            templates.append(json.load(template_file))
+    return templates
+
+
+def template_resources(templates, resource_type):
+    """
+    Returns the properties of all the resources of a type in the templates
+    """
+    return [resource['Properties'] for template in templates for resource in template.get('Resources', {}).values()
+            if resource['Type'] == resource_type]
 
 
 def test_count_nested_stacks(cf_template):
@@ -22,3 +97,719 @@ def test_count_nested_stacks(cf_template):
     """
     assert len([resource for resource in cf_template['Resources']
                 if cf_template['Resources'][resource]['Type'] == 'AWS::CloudFormation::Stack']) == 10
+
+
+def test_single_celery_beat_container(all_templates):
+    """
+    Test if exactly one container in the application runs the Celery beat scheduler, in a single task service
+    """
+    beat_services = []
+    beat_containers = 0
+    for template in all_templates:
+        resources = template.get('Resources', {})
+        beat_task_definition_ids = []
+        for logical_id, resource in resources.items():
+            if resource['Type'] != 'AWS::ECS::TaskDefinition':
+                continue
+            for container in resource['Properties']['ContainerDefinitions']:
+                command = ' '.join(container.get('Command', [])).split()
+                if 'beat' in command or '-B' in command or '--beat' in command:
+                    beat_containers += 1
+                    beat_task_definition_ids.append(logical_id)
+        beat_services += [resource for resource in resources.values()
+                          if resource['Type'] == 'AWS::ECS::Service'
+                          and resource['Properties']['TaskDefinition'].get('Ref') in beat_task_definition_ids]
+
+    assert beat_containers == 1
+    assert len(beat_services) == 1
+    assert beat_services[0]['Properties']['DesiredCount'] == 1
+    assert beat_services[0]['Properties']['DeploymentConfiguration']['MaximumPercent'] == 100
+
+
+def test_provisioned_tables_auto_scaling(all_templates):
+    """
+    Test if every provisioned table and global secondary index scales reads and writes with a target tracking policy
+    """
+    for template in all_templates:
+        resources = template.get('Resources', {})
+        scaled = set()
+        for logical_id, resource in resources.items():
+            if resource['Type'] != 'AWS::ApplicationAutoScaling::ScalableTarget' \
+                    or resource['Properties']['ServiceNamespace'] != 'dynamodb':
+                continue
+            assert any(policy['Type'] == 'AWS::ApplicationAutoScaling::ScalingPolicy'
+                       and policy['Properties']['PolicyType'] == 'TargetTrackingScaling'
+                       and policy['Properties']['ScalingTargetId'] == {'Ref': logical_id}
+                       for policy in resources.values())
+            resource_id = resource['Properties']['ResourceId']['Fn::Join'][1]
+            scaled.add((resource_id[1]['Ref'], ''.join(resource_id[2:]), resource['Properties']['ScalableDimension']))
+
+        for logical_id, resource in resources.items():
+            if resource['Type'] != 'AWS::DynamoDB::Table' \
+                    or resource['Properties'].get('BillingMode') == 'PAY_PER_REQUEST':
+                continue
+            for dimension in ['ReadCapacityUnits', 'WriteCapacityUnits']:
+                assert (logical_id, '', 'dynamodb:table:' + dimension) in scaled
+                for index in resource['Properties'].get('GlobalSecondaryIndexes', []):
+                    assert (logical_id, '/index/' + index['IndexName'], 'dynamodb:index:' + dimension) in scaled
+
+
+def test_tables_ttl_and_index_projections(all_templates, config_yaml):
+    """
+    Test if every table has its configured TTL attribute and every global secondary index its configured projection
+    """
+    tables = {resource['Properties']['TableName']: resource['Properties']
+              for template in all_templates for resource in template.get('Resources', {}).values()
+              if resource['Type'] == 'AWS::DynamoDB::Table'}
+
+    assert set(tables) == set(config_yaml['dynamodb_tables'])
+
+    for table_name, table_config in config_yaml['dynamodb_tables'].items():
+        if table_config.get('ttl_attribute'):
+            assert tables[table_name]['TimeToLiveSpecification'] == {
+                'AttributeName': table_config['ttl_attribute'], 'Enabled': True}
+        else:
+            assert 'TimeToLiveSpecification' not in tables[table_name]
+
+        projections = {index_name: index_config.get('projection', {'type': 'all'})
+                       for index_name, index_config in table_config.get('indexes', {}).items()}
+        for index in tables[table_name].get('GlobalSecondaryIndexes', []):
+            projection_config = projections.get(index['IndexName'], {'type': 'all'})
+            assert index['Projection']['ProjectionType'] == projection_config['type'].upper()
+            assert index['Projection'].get('NonKeyAttributes') == projection_config.get('non_key_attributes')
+
+
+def test_lean_index_projection_keeps_index_name(synth_with_config, config_yaml):
+    """
+    Test if a lean projection is set on the index under the name ConsoleMe queries, without adding another index
+    """
+    tables_config = json.loads(json.dumps(config_yaml['dynamodb_tables']))
+    tables_config['consoleme_resource_cache']['indexes']['arn-index']['projection'] = {
+        'type': 'include', 'non_key_attributes': ['accountId']}
+
+    templates = assembly_templates(synth_with_config(dynamodb_tables=tables_config))
+
+    cache_table = [table for table in template_resources(templates, 'AWS::DynamoDB::Table')
+                   if table['TableName'] == 'consoleme_resource_cache'][0]
+    assert cache_table['GlobalSecondaryIndexes'] == [{
+        'IndexName': 'arn-index',
+        'KeySchema': [{'AttributeName': 'arn', 'KeyType': 'HASH'}],
+        'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['accountId']},
+        'ProvisionedThroughput': {'ReadCapacityUnits': 10, 'WriteCapacityUnits': 10}
+    }]
+
+
+def test_dax_cluster(all_templates, synth_with_config, config_yaml):
+    """
+    Test if enabling DAX creates the cluster in its subnet group, reachable from the ConsoleMe tasks, which are
+    granted the DAX data actions, and renders its TLS endpoint into the configuration
+    """
+    assert not template_resources(all_templates, 'AWS::DAX::Cluster')
+
+    templates = assembly_templates(synth_with_config(dax=dict(config_yaml['dax'], enabled=True)))
+    resources = {logical_id: resource for template in templates
+                 for logical_id, resource in template.get('Resources', {}).items()}
+    outputs = {output_name: output['Value'] for template in templates
+               for output_name, output in template.get('Outputs', {}).items()}
+
+    clusters = template_resources(templates, 'AWS::DAX::Cluster')
+    assert len(clusters) == 1
+    assert clusters[0]['ClusterName'] == 'consoleme-dax'
+    assert clusters[0]['NodeType'] == config_yaml['dax']['node_type']
+    assert clusters[0]['ReplicationFactor'] == config_yaml['dax']['replication_factor']
+    assert clusters[0]['ClusterEndpointEncryptionType'] == 'TLS'
+    assert resources[clusters[0]['SubnetGroupName']['Ref']]['Type'] == 'AWS::DAX::SubnetGroup'
+
+    # The task security group is passed between the nested stacks as an output of the VPC stack
+    dax_sg_output = clusters[0]['SecurityGroupIds'][0]['Ref'].split('Outputs')[-1]
+    dax_sg = outputs[dax_sg_output]['Fn::GetAtt'][0]
+    service_sg_outputs = {security_group['Ref'].split('Outputs')[-1]
+                          for service in template_resources(templates, 'AWS::ECS::Service')
+                          for security_group in service['NetworkConfiguration']['AwsvpcConfiguration']['SecurityGroups']}
+    dax_ingress = [ingress for ingress in template_resources(templates, 'AWS::EC2::SecurityGroupIngress')
+                   if ingress['GroupId'] == {'Fn::GetAtt': [dax_sg, 'GroupId']}]
+    assert len(service_sg_outputs) == 1
+    assert len(dax_ingress) == 1
+    assert dax_ingress[0]['FromPort'] == dax_ingress[0]['ToPort'] == 9111
+    assert dax_ingress[0]['SourceSecurityGroupId'] == outputs[service_sg_outputs.pop()]
+
+    task_role = [logical_id for logical_id, resource in resources.items()
+                 if resource['Type'] == 'AWS::IAM::Role' and resource['Properties'].get('RoleName') == 'ConsolemeTaskRole']
+    dax_statements = [statement for policy in template_resources(templates, 'AWS::IAM::Policy')
+                      if {'Ref': task_role[0]} in policy['Roles']
+                      for statement in policy['PolicyDocument']['Statement']
+                      if all(action.startswith('dax:') for action in statement['Action'])]
+    assert len(dax_statements) == 1
+    assert {'dax:GetItem', 'dax:Query', 'dax:PutItem'} <= set(dax_statements[0]['Action'])
+    assert dax_statements[0]['Resource'].endswith(':cache/consoleme-dax')
+
+    config_resources = [properties for properties in template_resources(templates, 'AWS::CloudFormation::CustomResource')
+                        if 'Config' in properties]
+    dax_endpoint = config_resources[0]['DAX_ENDPOINT']['Fn::Join'][1]
+    assert dax_endpoint[0] == 'daxs://'
+    assert outputs[dax_endpoint[1]['Ref'].split('Outputs')[-1]] == {'Fn::GetAtt': ['DAXCluster', 'ClusterDiscoveryEndpoint']}
+
+
+def test_spoke_accounts_stackset_template():
+    """
+    Test if the StackSet template trusts the main account task role, without requiring CDK bootstrapping
+    """
+    template = json.loads(ConsolemeSpokeAccountsStack.template_body('111111111111'))
+
+    assert 'Rules' not in template and 'Parameters' not in template
+    roles = [resource['Properties'] for resource in template['Resources'].values()
+             if resource['Type'] == 'AWS::IAM::Role']
+    assert len(roles) == 1
+    assert roles[0]['RoleName'] == 'ConsolemeTrustRole'
+    assert roles[0]['AssumeRolePolicyDocument']['Statement'][0]['Principal'] == {
+        'AWS': 'arn:aws:iam::111111111111:role/ConsolemeTaskRole'}
+
+
+def test_spoke_accounts_stacks(cloud_assembly, all_templates, config_yaml, synth_with_config):
+    """
+    Test if the stacks mode deploys the trust role with a stack named after each spoke account, in that account
+    """
+    spoke_stack = cloud_assembly.get_stack_by_name('ConsolemeSpoke' + config_yaml['spoke_accounts'][0])
+
+    assert spoke_stack.environment.account == config_yaml['spoke_accounts'][0]
+    assert [resource for resource in spoke_stack.template['Resources'].values()
+            if resource['Type'] == 'AWS::IAM::Role']
+    assert not template_resources(all_templates, 'AWS::CloudFormation::StackSet')
+
+    spoke_accounts = ['123456789123', '123456789124', '123456789125']
+    spoke_stacks = {stack.stack_name: stack for stack in synth_with_config(spoke_accounts=spoke_accounts).stacks
+                    if stack.stack_name.startswith('ConsolemeSpoke')}
+
+    assert set(spoke_stacks) == {'ConsolemeSpoke' + account_id for account_id in spoke_accounts}
+    for account_id in spoke_accounts:
+        assert spoke_stacks['ConsolemeSpoke' + account_id].environment.account == account_id
+        assert [resource['Properties']['RoleName'] for resource in spoke_stacks['ConsolemeSpoke' + account_id].template[
+            'Resources'].values() if resource['Type'] == 'AWS::IAM::Role'] == ['ConsolemeTrustRole']
+
+
+@pytest.mark.parametrize('deployment_override, permission_model, deployment_targets, auto_deployment', [
+    ({}, 'SELF_MANAGED', {'Accounts': ['123456789123', '123456789124']}, None),
+    ({'organizational_unit_ids': ['ou-abcd-12345678'], 'call_as': 'DELEGATED_ADMIN'}, 'SERVICE_MANAGED',
+     {'OrganizationalUnitIds': ['ou-abcd-12345678']}, {'Enabled': True, 'RetainStacksOnAccountRemoval': False})
+])
+def test_spoke_accounts_stackset(synth_with_config, config_yaml, deployment_override, permission_model,
+                                 deployment_targets, auto_deployment):
+    """
+    Test if the stackset mode rolls out the trust role to the spoke accounts list with the self-managed permission model,
+    or to organizational units with the service-managed permission model and automatic deployment to new accounts
+    """
+    deployment_config = dict(config_yaml['spoke_accounts_deployment'], mode='stackset', **deployment_override)
+    cloud_assembly = synth_with_config(spoke_accounts=['123456789123', '123456789124'],
+                                       spoke_accounts_deployment=deployment_config)
+
+    assert not [stack for stack in cloud_assembly.stacks if stack.stack_name.startswith('ConsolemeSpoke')]
+    stack_sets = template_resources(assembly_templates(cloud_assembly), 'AWS::CloudFormation::StackSet')
+    assert len(stack_sets) == 1
+    assert stack_sets[0]['PermissionModel'] == permission_model
+    assert stack_sets[0]['CallAs'] == deployment_config['call_as']
+    assert stack_sets[0].get('AutoDeployment') == auto_deployment
+    assert stack_sets[0]['StackInstancesGroup'] == [{'DeploymentTargets': deployment_targets, 'Regions': ['us-east-1']}]
+    assert stack_sets[0]['OperationPreferences'] == {
+        'FailureTolerancePercentage': deployment_config['failure_tolerance_percentage'],
+        'MaxConcurrentPercentage': deployment_config['max_concurrent_percentage'],
+        'RegionConcurrencyType': 'PARALLEL'
+    }
+
+
+def test_config_custom_resource_content_hash(all_templates, config_yaml):
+    """
+    Test if the configuration file custom resource is keyed on a content hash instead of a value changing every synth,
+    and does not expose secrets in its properties
+    """
+    config_resources = [resource['Properties'] for template in all_templates
+                        for logical_id, resource in template.get('Resources', {}).items()
+                        if logical_id.startswith('CreateConfigurationFile')
+                        and resource['Type'] == 'AWS::CloudFormation::CustomResource']
+
+    assert len(config_resources) == 1
+    assert 'UUID' not in config_resources[0]
+    assert len(config_resources[0]['ConfigHash']) == 64
+    assert config_yaml['jwt_secret'] not in json.dumps(config_resources[0])
+    assert 'OIDC_CLIENT_SECRET' not in config_resources[0]
+    assert 'REDIS_HOST' in config_resources[0]
+
+
+def test_config_custom_resource_identical_across_synths(synth_with_config):
+    """
+    Test if synthesizing twice renders identical configuration file custom resource properties,
+    so deploys without changes leave the custom resource untouched
+    """
+    discovery_config = {'source': 'organizations', 'refresh_schedule': 'rate(1 hour)'}
+    first, second = [template_resources(assembly_templates(synth_with_config(spoke_accounts_discovery=discovery_config)),
+                                        'AWS::CloudFormation::CustomResource') for _ in range(2)]
+
+    assert [properties for properties in first if 'ConfigHash' in properties]
+    assert first == second
+
+
+def test_discovered_accounts_refreshed_on_schedule(all_templates, synth_with_config):
+    """
+    Test if accounts discovered from AWS Organizations are refreshed on a schedule, which invokes the configuration
+    lambda to rewrite the hot reloaded configuration, while accounts from config.yaml are only rendered on deploy
+    """
+    assert not [rule for rule in template_resources(all_templates, 'AWS::Events::Rule')
+                if 'Refresh' in json.dumps(rule)]
+
+    templates = assembly_templates(synth_with_config(
+        spoke_accounts_discovery={'source': 'organizations', 'refresh_schedule': 'rate(6 hours)'}))
+
+    refresh_rules = [rule for rule in template_resources(templates, 'AWS::Events::Rule')
+                     if rule.get('ScheduleExpression') == 'rate(6 hours)']
+    assert len(refresh_rules) == 1
+    assert json.loads(refresh_rules[0]['Targets'][0]['Input']) == {'RequestType': 'Refresh'}
+    assert 'CreateConfigurationFileLambda' in json.dumps(refresh_rules[0]['Targets'][0]['Arn'])
+    assert not [policy for policy in template_resources(templates, 'AWS::IAM::Policy')
+                if 'ecs:UpdateService' in json.dumps(policy)]
+
+
+def test_config_lambda_bundled_with_dictdiffer(cloud_assembly):
+    """
+    Test if the configuration lambda asset is bundled with its dictdiffer dependency
+    """
+    lambda_assets = [os.path.join(cloud_assembly.directory, entry) for entry in os.listdir(cloud_assembly.directory)
+                     if os.path.isfile(os.path.join(cloud_assembly.directory, entry, 'index.py'))
+                     and os.path.isdir(os.path.join(cloud_assembly.directory, entry, 'dictdiffer'))]
+
+    assert len(lambda_assets) == 1
+    assert not os.path.exists(os.path.join(lambda_assets[0], '__pycache__'))
+
+
+def test_containers_carry_config_restart_token(all_templates):
+    """
+    Test if every ConsoleMe and Celery container is rolled by the configuration restart token
+    """
+    containers = [container for template in all_templates for resource in template.get('Resources', {}).values()
+                  if resource['Type'] == 'AWS::ECS::TaskDefinition'
+                  for container in resource['Properties']['ContainerDefinitions']]
+
+    assert containers
+    for container in containers:
+        assert 'CONSOLEME_CONFIG_RESTART_TOKEN' in [variable['Name'] for variable in container['Environment']]
+
+
+def test_config_fetched_once_per_task(all_templates):
+    """
+    Test if every task fetches the configuration file once in an init container, which its application container
+    waits on and reads from a shared volume
+    """
+    task_definitions = [resource['Properties'] for template in all_templates
+                        for resource in template.get('Resources', {}).values()
+                        if resource['Type'] == 'AWS::ECS::TaskDefinition']
+
+    assert task_definitions
+    for task_definition in task_definitions:
+        containers = {container['Name']: container for container in task_definition['ContainerDefinitions']}
+        init_container = containers.pop('ConfigInitContainer')
+        assert init_container['Essential'] is False
+        volume_name = init_container['MountPoints'][0]['SourceVolume']
+        assert volume_name in [volume['Name'] for volume in task_definition['Volumes']]
+
+        for container in containers.values():
+            assert {'ContainerName': 'ConfigInitContainer', 'Condition': 'SUCCESS'} in container['DependsOn']
+            assert container['MountPoints'][0]['SourceVolume'] == volume_name
+            assert container['MountPoints'][0]['ReadOnly'] is True
+            assert 'retrieve_or_decode_configuration' not in ' '.join(container['Command'])
+
+
+def test_redis_initialized_once_per_deployment(all_templates):
+    """
+    Test if Redis is initialized by a standalone task run before the services, and not on every worker start
+    """
+    init_task_definitions = []
+    for template in all_templates:
+        resources = template.get('Resources', {})
+        for logical_id, resource in resources.items():
+            if resource['Type'] == 'AWS::ECS::TaskDefinition' and any(
+                    'initialize_redis_oss.py' in ' '.join(container.get('Command', []))
+                    for container in resource['Properties']['ContainerDefinitions']):
+                init_task_definitions.append((logical_id, resources))
+
+    assert len(init_task_definitions) == 1
+    logical_id, resources = init_task_definitions[0]
+
+    redis_init = [resource_id for resource_id, resource in resources.items()
+                  if resource['Type'] == 'AWS::CloudFormation::CustomResource'
+                  and resource['Properties'].get('TaskDefinition') == {'Ref': logical_id}]
+    services = [resource for resource in resources.values() if resource['Type'] == 'AWS::ECS::Service']
+
+    assert len(redis_init) == 1
+    assert services
+    for service in services:
+        assert service['Properties']['TaskDefinition'] != {'Ref': logical_id}
+        assert redis_init[0] in service['DependsOn']
+
+
+def test_redis_replication_groups(all_templates, synth_with_config, config_yaml):
+    """
+    Test if Redis runs as single nodes by default, and as replication groups with the configured replicas and
+    Multi-AZ failover when replicas are set, ConsoleMe using the primary endpoint and the broker metrics the reader endpoint
+    """
+    assert len(template_resources(all_templates, 'AWS::ElastiCache::CacheCluster')) == 2
+    assert not template_resources(all_templates, 'AWS::ElastiCache::ReplicationGroup')
+
+    templates = assembly_templates(synth_with_config(
+        redis=dict(config_yaml['redis'], replicas_per_shard=2, automatic_failover=True),
+        celery_broker_redis=dict(config_yaml['celery_broker_redis'], replicas_per_shard=1, automatic_failover=False)))
+
+    assert not template_resources(templates, 'AWS::ElastiCache::CacheCluster')
+    replication_groups = {resource['Properties']['ReplicationGroupDescription']: (logical_id, resource['Properties'])
+                          for template in templates for logical_id, resource in template.get('Resources', {}).items()
+                          if resource['Type'] == 'AWS::ElastiCache::ReplicationGroup'}
+    assert len(replication_groups) == 2
+
+    cache_id, cache_group = replication_groups['Replication group for ConsoleMe cache Redis']
+    assert cache_group['ReplicasPerNodeGroup'] == 2
+    assert cache_group['AutomaticFailoverEnabled'] is True
+    assert cache_group['MultiAZEnabled'] is True
+
+    broker_id, broker_group = replication_groups['Replication group for ConsoleMe Celery broker Redis']
+    assert broker_group['ReplicasPerNodeGroup'] == 1
+    assert broker_group['AutomaticFailoverEnabled'] is False
+    assert broker_group['MultiAZEnabled'] is False
+
+    cache_outputs = json.dumps([template.get('Outputs', {}) for template in templates])
+    assert json.dumps({'Fn::GetAtt': [cache_id, 'PrimaryEndPoint.Address']}) in cache_outputs
+    assert json.dumps({'Fn::GetAtt': [cache_id, 'ReaderEndPoint.Address']}) not in cache_outputs
+    broker_metrics_environment = [function['Environment']['Variables']
+                                  for function in template_resources(templates, 'AWS::Lambda::Function')
+                                  if function.get('Environment', {}).get('Variables', {}).get('CELERY_QUEUES')]
+    assert broker_metrics_environment[0]['REDIS_HOST'] == {'Fn::GetAtt': [broker_id, 'ReaderEndPoint.Address']}
+
+
+def test_separate_cache_and_broker_redis(synth_with_config, config_yaml):
+    """
+    Test if the ConsoleMe cache and the Celery broker run on separate Redis clusters, each with its own
+    maxmemory policy, and if the Celery broker URL points at the broker cluster
+    """
+    templates = assembly_templates(synth_with_config(
+        redis=dict(config_yaml['redis'], maxmemory_policy='volatile-lru')))
+
+    resources = {logical_id: resource for template in templates
+                 for logical_id, resource in template.get('Resources', {}).items()}
+    clusters = {logical_id: resource['Properties'] for logical_id, resource in resources.items()
+                if resource['Type'] == 'AWS::ElastiCache::CacheCluster'}
+    maxmemory_policies = {
+        logical_id: resources[cluster['CacheParameterGroupName']['Ref']]['Properties']['Properties']['maxmemory-policy']
+        for logical_id, cluster in clusters.items()}
+
+    assert maxmemory_policies == {'RedisCluster': 'volatile-lru', 'BrokerRedisCluster': 'noeviction'}
+
+    config_resources = [properties for properties in template_resources(templates, 'AWS::CloudFormation::CustomResource')
+                        if 'Config' in properties]
+    assert len(config_resources) == 1
+    assert json.loads(config_resources[0]['Config'])['celery']['broker']['global'] == 'redis://${CELERY_BROKER_HOST}:6379/0'
+    assert 'CacheBrokerRedisCluster' in config_resources[0]['CELERY_BROKER_HOST']['Ref']
+    assert 'CacheRedisCluster' in config_resources[0]['REDIS_HOST']['Ref']
+
+
+def task_definition_images(templates):
+    """
+    Returns the image of every container in the templates
+    """
+    return [json.dumps(container['Image']) for task_definition in template_resources(templates, 'AWS::ECS::TaskDefinition')
+            for container in task_definition['ContainerDefinitions']]
+
+
+def test_container_image_pulled_from_docker_hub(all_templates, config_yaml):
+    """
+    Test if every container pulls the image from Docker Hub by default, without an ECR pull-through cache rule
+    """
+    images = task_definition_images(all_templates)
+
+    assert config_yaml['container_registry']['mode'] == 'docker_hub'
+    assert not template_resources(all_templates, 'AWS::ECR::PullThroughCacheRule')
+    assert images
+    for image in images:
+        assert '.dkr.ecr.' not in image
+        assert config_yaml['container_image'] in image
+
+
+def test_container_image_pulled_from_ecr(synth_with_config, config_yaml):
+    """
+    Test if every container pulls the image through the ECR pull-through cache rule when it is set, and not from Docker Hub
+    """
+    registry_config = dict(config_yaml['container_registry'], mode='pull_through_cache')
+    templates = assembly_templates(synth_with_config(container_registry=registry_config))
+    rules = template_resources(templates, 'AWS::ECR::PullThroughCacheRule')
+    images = task_definition_images(templates)
+
+    assert len(rules) == 1
+    assert rules[0]['EcrRepositoryPrefix'] == registry_config['repository_prefix']
+    assert rules[0]['CredentialArn'] == registry_config['credential_arn']
+    assert images
+    for image in images:
+        assert '.dkr.ecr.' in image
+        assert '/' + registry_config['repository_prefix'] + '/' + config_yaml['container_image'] in image
+
+
+def test_services_run_on_latest_platform_version(all_templates):
+    """
+    Test if every ECS service runs on the latest Fargate platform version, without pinning an older one
+    """
+    services = template_resources(all_templates, 'AWS::ECS::Service')
+
+    assert services
+    assert not [service for service in services if 'PlatformVersion' in service]
+
+
+def test_web_service_scaling_policies(all_templates, config_yaml):
+    """
+    Test if the web service tracks CPU, memory and requests per target with separate cooldowns,
+    scales out on the p95 latency, and scales on the configured schedules
+    """
+    web_autoscaling_config = config_yaml['web_autoscaling']
+    scheduled_targets = [(logical_id, template['Resources']) for template in all_templates
+                         for logical_id, resource in template.get('Resources', {}).items()
+                         if resource['Type'] == 'AWS::ApplicationAutoScaling::ScalableTarget'
+                         and resource['Properties'].get('ScheduledActions')]
+    assert len(scheduled_targets) == 1
+    target_id, resources = scheduled_targets[0]
+    policies = [resource['Properties'] for resource in resources.values()
+                if resource['Type'] == 'AWS::ApplicationAutoScaling::ScalingPolicy'
+                and resource['Properties']['ScalingTargetId'] == {'Ref': target_id}]
+
+    target_tracking = {}
+    for policy in policies:
+        if policy['PolicyType'] == 'TargetTrackingScaling':
+            configuration = policy['TargetTrackingScalingPolicyConfiguration']
+            target_tracking[configuration['PredefinedMetricSpecification']['PredefinedMetricType']] = configuration
+    assert {metric: configuration['TargetValue'] for metric, configuration in target_tracking.items()} == {
+        'ECSServiceAverageCPUUtilization': web_autoscaling_config['cpu_target'],
+        'ECSServiceAverageMemoryUtilization': web_autoscaling_config['memory_target'],
+        'ALBRequestCountPerTarget': web_autoscaling_config['requests_per_target']
+    }
+    for configuration in target_tracking.values():
+        assert configuration['ScaleInCooldown'] == web_autoscaling_config['scale_in_cooldown_seconds']
+        assert configuration['ScaleOutCooldown'] == web_autoscaling_config['scale_out_cooldown_seconds']
+
+    assert [policy['StepScalingPolicyConfiguration']['StepAdjustments'][0]['ScalingAdjustment']
+            for policy in policies if policy['PolicyType'] == 'StepScaling'] == [1]
+    latency_alarms = [resource['Properties'] for resource in resources.values()
+                      if resource['Type'] == 'AWS::CloudWatch::Alarm'
+                      and resource['Properties'].get('MetricName') == 'TargetResponseTime']
+    assert len(latency_alarms) == 1
+    assert latency_alarms[0]['ExtendedStatistic'] == 'p95'
+    assert latency_alarms[0]['Threshold'] == web_autoscaling_config['p95_latency_seconds']
+
+    assert [(action['Schedule'], action['ScalableTargetAction']['MinCapacity'])
+            for action in resources[target_id]['Properties']['ScheduledActions']] == [
+        (scheduled['schedule'], scheduled['min_capacity']) for scheduled in web_autoscaling_config['scheduled']]
+
+
+def test_services_capacity_provider_strategies(all_templates, config_yaml):
+    """
+    Test if the cluster has the Fargate capacity providers, the web and worker services use their configured strategies,
+    and the workers drain on SIGTERM
+    """
+    resources = [resource for template in all_templates for resource in template.get('Resources', {}).values()]
+    cluster_capacity_providers = [resource['Properties']['CapacityProviders'] for resource in resources
+                                  if resource['Type'] == 'AWS::ECS::ClusterCapacityProviderAssociations']
+    assert len(cluster_capacity_providers) == 1
+    assert sorted(cluster_capacity_providers[0]) == ['FARGATE', 'FARGATE_SPOT']
+
+    services = [resource['Properties'] for resource in resources if resource['Type'] == 'AWS::ECS::Service']
+    strategies = [[(strategy['CapacityProvider'], strategy.get('Base', 0), strategy.get('Weight', 0))
+                   for strategy in service['CapacityProviderStrategy']]
+                  for service in services if 'CapacityProviderStrategy' in service]
+    for service in ('web', 'celery_worker'):
+        expected = [(strategy['capacity_provider'], strategy.get('base', 0), strategy.get('weight', 0))
+                    for strategy in config_yaml['capacity_providers'][service]]
+        assert expected in strategies
+    for service in services:
+        assert not ('CapacityProviderStrategy' in service and 'LaunchType' in service)
+
+    containers = {container['Name']: container for resource in resources if resource['Type'] == 'AWS::ECS::TaskDefinition'
+                  for container in resource['Properties']['ContainerDefinitions']}
+    assert containers['CeleryContainer']['StopTimeout'] == 120
+    assert containers['CeleryContainer']['Command'][-1].startswith('exec celery')
+
+
+def test_task_sizes_and_celery_worker_options(all_templates, config_yaml):
+    """
+    Test if the tasks and their application containers are sized from the configuration,
+    and the Celery worker runs the configured pool, concurrency and prefetching
+    """
+    task_definitions = {container['Name']: (resource['Properties'], container) for template in all_templates
+                        for logical_id, resource in template.get('Resources', {}).items()
+                        if resource['Type'] == 'AWS::ECS::TaskDefinition'
+                        and logical_id.startswith(('Consoleme', 'Celery'))
+                        for container in resource['Properties']['ContainerDefinitions']}
+
+    # The web task reservations are split between its web processes
+    for task_name, container_name, containers in (('web', 'Container', config_yaml['web_processes']),
+                                                  ('celery_worker', 'CeleryContainer', 1),
+                                                  ('celery_beat', 'CeleryBeatContainer', 1)):
+        task_size = config_yaml['task_sizes'][task_name]
+        task_definition, container = task_definitions[container_name]
+        assert task_definition['Cpu'] == str(task_size['cpu'])
+        assert task_definition['Memory'] == str(task_size['memory_limit_mib'])
+        assert container['Cpu'] == task_size['container_cpu'] // containers
+        assert container['MemoryReservation'] == task_size['container_memory_reservation_mib'] // containers
+
+    worker_config = config_yaml['celery_worker']
+    worker_command = task_definitions['CeleryContainer'][1]['Command'][-1].split()
+    assert '--pool=' + worker_config['pool'] in worker_command
+    assert '--concurrency=' + str(worker_config['concurrency']) in worker_command
+    assert '--prefetch-multiplier=' + str(worker_config['prefetch_multiplier']) in worker_command
+    assert '--max-tasks-per-child=' + str(worker_config['max_tasks_per_child']) in worker_command
+    assert worker_command[worker_command.index('-l') + 1] == worker_config['log_level']
+
+
+def test_celery_worker_pools(all_templates, config_yaml):
+    """
+    Test if each Celery worker pool runs its own service consuming its queues, scaled on the length of those queues,
+    and the broker metrics lambda publishes the length of every pool queue
+    """
+    resources = {logical_id: resource for template in all_templates
+                 for logical_id, resource in template.get('Resources', {}).items()}
+    worker_commands = [container['Command'][-1].split() for resource in resources.values()
+                       if resource['Type'] == 'AWS::ECS::TaskDefinition'
+                       for container in resource['Properties']['ContainerDefinitions']
+                       if 'worker' in container.get('Command', [''])[-1].split()]
+    queue_alarms = [resource['Properties']['Dimensions'][0]['Value'] for resource in resources.values()
+                    if resource['Type'] == 'AWS::CloudWatch::Alarm'
+                    and resource['Properties'].get('MetricName') == 'QueueLength']
+    broker_metrics_queues = [resource['Properties']['Environment']['Variables']['CELERY_QUEUES']
+                             for resource in resources.values() if resource['Type'] == 'AWS::Lambda::Function'
+                             and 'CELERY_QUEUES' in resource['Properties'].get('Environment', {}).get('Variables', {})]
+
+    pools = config_yaml['celery_worker']['pools']
+    assert sorted(command[command.index('-Q') + 1] for command in worker_commands) == sorted(
+        ','.join(pool['queues']) for pool in pools.values())
+    assert any(logical_id.startswith('CeleryService') for logical_id in resources)
+    assert any(logical_id.startswith('CeleryCacheService') for logical_id in resources)
+    for pool in pools.values():
+        for queue_name in pool['queues']:
+            assert queue_name in queue_alarms
+            assert queue_name in broker_metrics_queues[0].split(',')
+
+
+def test_celery_worker_service_scaled_on_backlog(all_templates, config_yaml):
+    """
+    Test if the Celery worker service exists, and its scalable target carries the step scaling policies
+    driven by alarms on the broker backlog of its queue
+    """
+    worker_config = celery_worker_pools(config_yaml)['default']
+    resources = next(template['Resources'] for template in all_templates
+                     if any(logical_id.startswith('CeleryService') for logical_id in template.get('Resources', {})))
+    service_id = next(logical_id for logical_id, resource in resources.items()
+                      if logical_id.startswith('CeleryService') and resource['Type'] == 'AWS::ECS::Service')
+    target_id, target = next((logical_id, resource['Properties']) for logical_id, resource in resources.items()
+                             if resource['Type'] == 'AWS::ApplicationAutoScaling::ScalableTarget'
+                             and {'Fn::GetAtt': [service_id, 'Name']} in resource['Properties']['ResourceId']['Fn::Join'][1])
+    policy_ids = [logical_id for logical_id, resource in resources.items()
+                  if resource['Type'] == 'AWS::ApplicationAutoScaling::ScalingPolicy'
+                  and resource['Properties']['ScalingTargetId'] == {'Ref': target_id}]
+    alarms = [resource['Properties'] for resource in resources.values() if resource['Type'] == 'AWS::CloudWatch::Alarm'
+              and any(action in resource['Properties']['AlarmActions'] for action in
+                      [{'Ref': policy_id} for policy_id in policy_ids])]
+
+    assert (target['MinCapacity'], target['MaxCapacity']) == (worker_config['min_capacity'], worker_config['max_capacity'])
+    assert len(policy_ids) == 2
+    assert all(resources[policy_id]['Properties']['PolicyType'] == 'StepScaling' for policy_id in policy_ids)
+    assert sorted(alarm['Threshold'] for alarm in alarms) == [
+        worker_config['scale_in_backlog'], worker_config['scale_out_backlog']]
+    for alarm in alarms:
+        assert alarm['MetricName'] == 'QueueLength'
+        assert alarm['Dimensions'] == [{'Name': 'Queue', 'Value': worker_config['queues'][0]}]
+
+
+def test_web_processes_behind_target_group(all_templates, config_yaml):
+    """
+    Test if each web process runs in its own container on its own port, registered on the target group,
+    with a configuration file listening on that port
+    """
+    resources = {logical_id: resource for template in all_templates
+                 for logical_id, resource in template.get('Resources', {}).items()}
+    web_task_definitions = {logical_id: resource['Properties'] for logical_id, resource in resources.items()
+                            if resource['Type'] == 'AWS::ECS::TaskDefinition'
+                            and logical_id.startswith('ConsolemeTaskDefinition')}
+    assert len(web_task_definitions) == 1
+    web_task_definition_id, web_task_definition = list(web_task_definitions.items())[0]
+    containers = web_task_definition['ContainerDefinitions']
+    web_ports = sorted(container['PortMappings'][0]['ContainerPort'] for container in containers
+                       if container.get('PortMappings'))
+    assert web_ports == [8081 + index for index in range(config_yaml['web_processes'])]
+
+    config_init_container = [container for container in containers if container['Name'] == 'ConfigInitContainer'][0]
+    config_init_environment = {variable['Name']: variable['Value'] for variable in config_init_container['Environment']}
+    assert config_init_environment['CONSOLEME_WEB_PORTS'] == ','.join(str(port) for port in web_ports[1:])
+    for container in containers:
+        if container.get('PortMappings'):
+            port = container['PortMappings'][0]['ContainerPort']
+            environment = {variable['Name']: variable['Value'] for variable in container['Environment']}
+            assert environment['CONFIG_LOCATION'].endswith('/config.yaml' if port == 8081 else f'/config-{port}.yaml')
+
+    web_services = [resource['Properties'] for resource in resources.values() if resource['Type'] == 'AWS::ECS::Service'
+                    and resource['Properties']['TaskDefinition'] == {'Ref': web_task_definition_id}]
+    assert len(web_services) == 1
+    assert sorted(load_balancer['ContainerPort'] for load_balancer in web_services[0]['LoadBalancers']) == web_ports
+
+
+def test_path_routing_services(all_templates, config_yaml):
+    """
+    Test if the listener routes each path group to its own target group and service, sized and scaled on its own
+    """
+    resources = {logical_id: resource for template in all_templates
+                 for logical_id, resource in template.get('Resources', {}).items()}
+    listener_rules = [resource['Properties'] for resource in resources.values()
+                      if resource['Type'] == 'AWS::ElasticLoadBalancingV2::ListenerRule']
+    assert len(listener_rules) == len(config_yaml['path_routing'])
+
+    for listener_rule, path_group_config in zip(sorted(listener_rules, key=lambda rule: rule['Priority']),
+                                                config_yaml['path_routing'].values()):
+        assert listener_rule['Conditions'][0]['PathPatternConfig']['Values'] == path_group_config['paths']
+        target_group_id = listener_rule['Actions'][0]['TargetGroupArn']['Ref']
+        assert resources[target_group_id]['Properties']['HealthCheckPath'] == \
+            config_yaml['load_balancing']['health_check']['path']
+
+        services = [(logical_id, resource['Properties']) for logical_id, resource in resources.items()
+                    if resource['Type'] == 'AWS::ECS::Service'
+                    and any(load_balancer['TargetGroupArn'] == {'Ref': target_group_id}
+                            for load_balancer in resource['Properties'].get('LoadBalancers', []))]
+        assert len(services) == 1
+        service_id, service = services[0]
+        task_definition = resources[service['TaskDefinition']['Ref']]['Properties']
+        assert task_definition['Cpu'] == str(path_group_config['task_size']['cpu'])
+        assert service['DesiredCount'] == path_group_config['min_capacity']
+
+        scaling_targets = [logical_id for logical_id, resource in resources.items()
+                           if resource['Type'] == 'AWS::ApplicationAutoScaling::ScalableTarget'
+                           and service_id in json.dumps(resource['Properties']['ResourceId'])]
+        assert len(scaling_targets) == 1
+        target_values = sorted(
+            resource['Properties']['TargetTrackingScalingPolicyConfiguration']['TargetValue']
+            for resource in resources.values() if resource['Type'] == 'AWS::ApplicationAutoScaling::ScalingPolicy'
+            and resource['Properties']['ScalingTargetId'] == {'Ref': scaling_targets[0]})
+        assert target_values == sorted([path_group_config['cpu_target'], path_group_config['requests_per_target']])
+
+
+def test_target_groups_tuning(all_templates, config_yaml):
+    """
+    Test if every target group health checks the lightweight health endpoint, and drains, warms up
+    and spreads requests over its targets as configured
+    """
+    load_balancing_config = config_yaml['load_balancing']
+    health_check_config = load_balancing_config['health_check']
+    target_groups = [resource['Properties'] for template in all_templates
+                     for resource in template.get('Resources', {}).values()
+                     if resource['Type'] == 'AWS::ElasticLoadBalancingV2::TargetGroup']
+    assert len(target_groups) == 1 + len(config_yaml['path_routing'])
+
+    for target_group in target_groups:
+        assert target_group['HealthCheckPath'] == health_check_config['path']
+        assert target_group['Matcher'] == {'HttpCode': health_check_config['healthy_http_codes']}
+        assert target_group['HealthCheckIntervalSeconds'] == health_check_config['interval_seconds']
+        assert target_group['HealthCheckTimeoutSeconds'] == health_check_config['timeout_seconds']
+        assert target_group['HealthyThresholdCount'] == health_check_config['healthy_threshold_count']
+        assert target_group['UnhealthyThresholdCount'] == health_check_config['unhealthy_threshold_count']
+        attributes = {attribute['Key']: attribute['Value'] for attribute in target_group['TargetGroupAttributes']}
+        assert attributes['deregistration_delay.timeout_seconds'] == str(
+            load_balancing_config['deregistration_delay_seconds'])
+        assert attributes['slow_start.duration_seconds'] == str(load_balancing_config['slow_start_seconds'])
+        assert attributes['load_balancing.algorithm.type'] == 'round_robin'
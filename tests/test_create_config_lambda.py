@@ -0,0 +1,261 @@
+"""
+Tests for the configuration file lambda, running against a local AWS stand-in with thousands of spoke accounts
+"""
+
+import importlib.util
+import json
+import os
+
+import boto3
+import pytest
+import yaml
+
+from moto import mock_aws
+
+from configuration import load_config
+from nested_stacks.config_stack import render_config, celery_task_routes
+
+BUCKET_NAME = 'consoleme-config-bucket'
+MAIN_ACCOUNT_ID = '123456789012'
+LAMBDA_DIR = 'resources/create_config_lambda'
+
+DEPLOY_TIME_VALUES = {
+    'ISSUER': 'consoleme.domain.com',
+    'JWT_SECRET': 'jwt-secret',
+    'OIDC_CLIENT_ID': 'client-id',
+    'OIDC_CLIENT_SECRET': 'client-secret',
+    'OIDC_METADATA_URL': 'https://cognito-idp.us-east-1.amazonaws.com/pool/.well-known/openid-configuration',
+    'REDIS_HOST': 'redis.local',
+    'CELERY_BROKER_HOST': 'broker.local',
+    'SES_IDENTITY_ARN': 'arn:aws:ses:us-east-1:123456789012:identity/consoleme.domain.com',
+    'DAX_ENDPOINT': 'daxs://dax.local'
+}
+
+
+@pytest.fixture
+def create_config_lambda(monkeypatch):
+    """
+    Returns the configuration file lambda module, with its AWS clients backed by the local stand-in
+    """
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('DEPLOYMENT_BUCKET', BUCKET_NAME)
+    monkeypatch.setenv('ACCOUNT_NUMBER', MAIN_ACCOUNT_ID)
+    for name, value in DEPLOY_TIME_VALUES.items():
+        monkeypatch.setenv(name, value)
+
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket=BUCKET_NAME)
+
+        spec = importlib.util.spec_from_file_location(
+            'create_config_lambda', os.path.join(LAMBDA_DIR, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+
+
+def config_event(request_type, spoke_accounts=(), dax=False, task_routes=None):
+    """
+    Returns a custom resource event with the configuration rendered at synth time, deploy time values as placeholders
+    """
+    config_values = {name: '${' + name + '}' for name in DEPLOY_TIME_VALUES if dax or name != 'DAX_ENDPOINT'}
+    config_values.update({
+        'AWS_REGION': 'us-east-1',
+        'SUPPORT_CHAT_URL': 'https://discord.gg/nQVpNGGkYu',
+        'APPLICATION_ADMIN': 'consoleme_admin',
+        'ACCOUNT_NUMBER': MAIN_ACCOUNT_ID
+    })
+
+    return {
+        'RequestType': request_type,
+        'ResourceProperties': {'Config': json.dumps(
+            render_config(config_values, list(spoke_accounts), task_routes))}
+    }
+
+
+def rendered_object(key):
+    """
+    Returns one of the configuration files the lambda wrote to S3
+    """
+    config_object = boto3.client('s3').get_object(Bucket=BUCKET_NAME, Key=key)
+    return yaml.safe_load(config_object['Body'].read())
+
+
+def rendered_config():
+    """
+    Returns the configuration ConsoleMe loads, the configuration file merged with the hot reloaded file it extends
+    """
+    return dict(rendered_object('config.yaml'), **rendered_object('hot_config.yaml'))
+
+
+def rendered_account_ids_to_name():
+    """
+    Returns the account mapping from the configuration file the lambda wrote to S3
+    """
+    return rendered_config()['account_ids_to_name']
+
+
+def test_organizations_accounts_rendered_with_names(create_config_lambda, monkeypatch):
+    """
+    Test if all the active accounts are paged through AWS Organizations and rendered with their names
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 'organizations')
+    organizations_client = boto3.client('organizations')
+    organizations_client.create_organization(FeatureSet='ALL')
+    for index in range(2000):
+        organizations_client.create_account(Email=f'spoke{index}@domain.com', AccountName=f'spoke-{index}')
+
+    response = create_config_lambda.handler(config_event('Create'), None)
+
+    assert response['Data']['Changed'] == 'true'
+    account_ids_to_name = rendered_account_ids_to_name()
+    accounts = organizations_client.get_paginator('list_accounts').paginate().build_full_result()['Accounts']
+    # The organization management account is the ConsoleMe main account, and keeps its real name
+    assert len(accounts) == 2001
+    assert len(account_ids_to_name) == 2001
+    assert all(account_ids_to_name[account['Id']] == [account['Name']] for account in accounts)
+
+
+def test_s3_manifest_accounts_rendered(create_config_lambda, monkeypatch):
+    """
+    Test if the accounts are streamed from a CSV manifest in S3, with placeholder names when a name is missing
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 's3')
+    monkeypatch.setenv('SPOKE_ACCOUNTS_MANIFEST_KEY', 'spoke_accounts.csv')
+    manifest = '# account_id,account_name\n' + ''.join(
+        f"{100000000000 + index},team's account {index}\n" for index in range(5000)) + '999999999999\n'
+    boto3.client('s3').put_object(Bucket=BUCKET_NAME, Key='spoke_accounts.csv', Body=manifest.encode('utf-8'))
+
+    create_config_lambda.handler(config_event('Update'), None)
+
+    account_ids_to_name = rendered_account_ids_to_name()
+    assert len(account_ids_to_name) == 5002
+    assert account_ids_to_name['100000004999'] == ["team's account 4999"]
+    assert account_ids_to_name['999999999999'] == ['account_999999999999']
+
+
+def test_config_accounts_rendered_at_synth(create_config_lambda, monkeypatch):
+    """
+    Test if the spoke accounts from config.yaml rendered at synth time are kept, and the placeholders filled in
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 'config')
+
+    create_config_lambda.handler(config_event('Create', ['123456789123']), None)
+
+    config = rendered_config()
+    assert config['account_ids_to_name'] == {
+        '123456789123': ['account_123456789123'],
+        MAIN_ACCOUNT_ID: ['account_' + MAIN_ACCOUNT_ID]
+    }
+    assert config['url'] == 'https://consoleme.domain.com'
+    assert config['jwt_secret'] == 'jwt-secret'
+    assert config['oidc_secrets']['secret'] == 'client-secret'
+    assert config['celery']['broker']['global'] == 'redis://broker.local:6379/0'
+    assert config['celery']['active_region'] == 'us-east-1'
+    assert 'dax' not in config
+    assert '${' not in json.dumps(config)
+
+
+def test_celery_task_routes_rendered(create_config_lambda):
+    """
+    Test if the tasks of each worker pool are routed to its queue, next to the broker rendered from the template
+    """
+    create_config_lambda.handler(config_event('Create', task_routes=celery_task_routes(load_config())), None)
+
+    celery_config = rendered_config()['celery']
+    assert celery_config['task_routes'] == {'consoleme.celery_tasks.celery_tasks.cache_*': {'queue': 'cache'}}
+    assert celery_config['broker']['global'] == 'redis://broker.local:6379/0'
+
+
+def test_unchanged_config_not_rewritten(create_config_lambda, monkeypatch, mocker):
+    """
+    Test if an update rendering the same configuration file skips the upload, and a changed one uploads it
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 'config')
+    create_config_lambda.handler(config_event('Create', ['123456789123']), None)
+    put_object = mocker.spy(create_config_lambda.s3_client, 'put_object')
+
+    response = create_config_lambda.handler(config_event('Update', ['123456789123']), None)
+
+    put_object.assert_not_called()
+    assert response['Data']['Changed'] == 'false'
+    assert response['Data']['RestartRequiredKeys'] == ''
+    assert response['Data']['HotReloadedKeys'] == ''
+
+    monkeypatch.setenv('REDIS_HOST', 'redis-replacement.local')
+    create_config_lambda.handler(config_event('Update', ['123456789123']), None)
+
+    put_object.assert_called_once()
+    assert put_object.call_args.kwargs['Key'] == 'config.yaml'
+
+
+def test_config_split_into_restart_required_and_hot_reloaded_files(create_config_lambda, monkeypatch):
+    """
+    Test if the keys only read on start stay in the configuration file, which extends the hot reloaded file
+    holding every other key, and turns on reloading it
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 'config')
+
+    create_config_lambda.handler(config_event('Create', ['123456789123'], dax=True), None)
+
+    config = rendered_object('config.yaml')
+    hot_config = rendered_object('hot_config.yaml')
+    assert set(config) <= set(create_config_lambda.RESTART_REQUIRED_KEYS)
+    assert {'redis', 'celery', 'dax', 'jwt_secret', 'oidc_secrets'} <= set(config)
+    assert config['extends'] == ['AWS_S3:s3://' + BUCKET_NAME + '/hot_config.yaml']
+    assert config['config']['automatically_reload_configuration'] is True
+    assert 'account_ids_to_name' in hot_config
+    assert not set(hot_config) & set(create_config_lambda.RESTART_REQUIRED_KEYS)
+
+
+def test_only_restart_required_changes_roll_the_services(create_config_lambda, monkeypatch):
+    """
+    Test if a change to a hot reloaded key keeps the restart token, while a change to a key only read on start,
+    nested keys included, changes it
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 'config')
+    created = create_config_lambda.handler(config_event('Create', ['123456789123']), None)['Data']
+
+    accounts_added = create_config_lambda.handler(
+        config_event('Update', ['123456789123', '123456789124']), None)['Data']
+
+    assert accounts_added['Changed'] == 'true'
+    assert accounts_added['HotReloadedKeys'] == 'account_ids_to_name.123456789124'
+    assert accounts_added['RestartRequiredKeys'] == ''
+    assert accounts_added['RestartToken'] == created['RestartToken']
+
+    monkeypatch.setenv('REDIS_HOST', 'redis-replacement.local')
+    redis_replaced = create_config_lambda.handler(
+        config_event('Update', ['123456789123', '123456789124'], dax=True), None)['Data']
+
+    assert redis_replaced['RestartRequiredKeys'] == 'dax,redis.host.global'
+    assert redis_replaced['HotReloadedKeys'] == ''
+    assert redis_replaced['RestartToken'] != created['RestartToken']
+    assert rendered_config()['dax'] == {'endpoint': 'daxs://dax.local'}
+
+
+def test_refresh_picks_up_new_accounts(create_config_lambda, monkeypatch, mocker):
+    """
+    Test if the scheduled refresh renders accounts added to the manifest since the last deploy into the current
+    hot reloaded configuration, and leaves the configuration file read on start untouched
+    """
+    monkeypatch.setenv('SPOKE_ACCOUNTS_SOURCE', 's3')
+    monkeypatch.setenv('SPOKE_ACCOUNTS_MANIFEST_KEY', 'spoke_accounts.csv')
+    s3_client = boto3.client('s3')
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='spoke_accounts.csv', Body=b'123456789123,spoke\n')
+    create_config_lambda.handler(config_event('Create'), None)
+    put_object = mocker.spy(create_config_lambda.s3_client, 'put_object')
+    refresh_event = {'RequestType': 'Refresh'}
+
+    assert create_config_lambda.handler(refresh_event, None)['Data']['Changed'] == 'false'
+    put_object.assert_not_called()
+
+    s3_client.put_object(
+        Bucket=BUCKET_NAME, Key='spoke_accounts.csv', Body=b'123456789123,spoke\n123456789124,new spoke\n')
+    response = create_config_lambda.handler(refresh_event, None)
+
+    assert response['Data']['HotReloadedKeys'] == 'account_ids_to_name.123456789124'
+    assert rendered_account_ids_to_name()['123456789124'] == ['new spoke']
+    assert rendered_config()['url'] == 'https://consoleme.domain.com'
+    assert [call.kwargs['Key'] for call in put_object.call_args_list] == ['hot_config.yaml']
@@ -0,0 +1,95 @@
+"""
+Tests for the one-shot Redis initialization task lambda
+"""
+
+import importlib.util
+
+import pytest
+
+RESOURCE_PROPERTIES = {
+    'Cluster': 'arn:aws:ecs:us-east-1:123456789012:cluster/consoleme',
+    'TaskDefinition': 'arn:aws:ecs:us-east-1:123456789012:task-definition/redis-init:3',
+    'Subnets': ['subnet-1', 'subnet-2'],
+    'SecurityGroups': ['sg-1']
+}
+TASK_ARN = 'arn:aws:ecs:us-east-1:123456789012:task/consoleme/1'
+
+
+@pytest.fixture
+def redis_init_lambda(monkeypatch):
+    """
+    Returns the Redis initialization lambda module
+    """
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    spec = importlib.util.spec_from_file_location('redis_init_lambda', 'resources/redis_init_lambda/index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def ecs_client(redis_init_lambda, mocker):
+    """
+    Returns a mocked ECS client used by the lambda
+    """
+    return mocker.patch.object(redis_init_lambda, 'ecs_client')
+
+
+def stopped_task(exit_code):
+    """
+    Returns a described task, stopped after the Redis initialization container exited with the exit code
+    """
+    return {'tasks': [{
+        'lastStatus': 'STOPPED',
+        'stoppedReason': 'Essential container in task exited',
+        'containers': [
+            {'name': 'ConfigInitContainer', 'exitCode': 0},
+            {'name': 'RedisInitContainer', 'exitCode': exit_code}
+        ]
+    }]}
+
+
+def test_run_task_on_create_and_update(redis_init_lambda, ecs_client):
+    """
+    Test if the task runs on Fargate in the private subnets on every create and update, and not on delete
+    """
+    ecs_client.run_task.return_value = {'tasks': [{'taskArn': TASK_ARN}], 'failures': []}
+
+    for request_type in ['Create', 'Update']:
+        response = redis_init_lambda.on_event(
+            {'RequestType': request_type, 'ResourceProperties': RESOURCE_PROPERTIES}, None)
+        assert response == {'Data': {'TaskArn': TASK_ARN}}
+
+    assert redis_init_lambda.on_event({'RequestType': 'Delete', 'ResourceProperties': RESOURCE_PROPERTIES}, None) == {}
+    assert ecs_client.run_task.call_count == 2
+    run_task_arguments = ecs_client.run_task.call_args.kwargs
+    assert run_task_arguments['taskDefinition'] == RESOURCE_PROPERTIES['TaskDefinition']
+    assert run_task_arguments['launchType'] == 'FARGATE'
+    assert run_task_arguments['networkConfiguration']['awsvpcConfiguration']['subnets'] == ['subnet-1', 'subnet-2']
+
+
+def test_run_task_failures_raise(redis_init_lambda, ecs_client):
+    """
+    Test if a task which could not be placed fails the deployment
+    """
+    ecs_client.run_task.return_value = {'tasks': [], 'failures': [{'reason': 'RESOURCE:MEMORY'}]}
+
+    with pytest.raises(Exception, match='RESOURCE:MEMORY'):
+        redis_init_lambda.on_event({'RequestType': 'Create', 'ResourceProperties': RESOURCE_PROPERTIES}, None)
+
+
+def test_is_complete_waits_for_successful_exit(redis_init_lambda, ecs_client):
+    """
+    Test if the deployment waits for the task to stop, and fails when the initialization exited with an error
+    """
+    event = {'RequestType': 'Create', 'ResourceProperties': RESOURCE_PROPERTIES, 'Data': {'TaskArn': TASK_ARN}}
+
+    ecs_client.describe_tasks.return_value = {'tasks': [{'lastStatus': 'RUNNING', 'containers': []}]}
+    assert redis_init_lambda.is_complete(event, None) == {'IsComplete': False}
+
+    ecs_client.describe_tasks.return_value = stopped_task(0)
+    assert redis_init_lambda.is_complete(event, None) == {'IsComplete': True}
+
+    ecs_client.describe_tasks.return_value = stopped_task(1)
+    with pytest.raises(Exception, match='Redis initialization task failed'):
+        redis_init_lambda.is_complete(event, None)